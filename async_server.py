@@ -0,0 +1,259 @@
+""" Headless TCP server of the wavemeter on asyncio.
+
+    It speaks the framing of dummy_server_socket (message_frame), and needs
+    neither QApplication nor an event loop of Qt, so it runs on a headless box.
+    All connections are served by one asyncio event loop in its own thread.
+
+    The bridge to WavemeterController is AsyncCommHandler, which has the
+    interface of CommHandler seen by the controller (user_name, toMessageList).
+    1. Incoming : The received messages are put into the work list of the
+      controller with toWorkList, which is thread-safe.
+    2. Outgoing : toMessageList is called from the threads of the controller and
+      the PID loop. The message is encoded in the calling thread, kept in the
+      OutboundQueue of the client as in CommHandler, and the writer task of the
+      client is woken up with call_soon_threadsafe. The writer sends all pending
+      messages with a single write and waits until the socket drains below
+      high_water_mark.
+    A malformed message is answered with NAK, and the connection is closed.
+
+    Usage : python async_server.py [host] [port]
+"""
+
+import sys
+import asyncio
+import threading
+
+from PyQt5.QtCore import QByteArray, QDataStream, QIODevice
+
+from message_frame import FRAME_EXTENDED, FRAME_VERSION, OutboundQueue
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9010
+
+def decode_message(body):
+    """ Return [control, wvm, command, data] of the frame body, which is the frame without
+        its length.
+    """
+    block = QByteArray(body)
+    stream = QDataStream(block, QIODevice.ReadOnly)
+    stream.setVersion(QDataStream.Qt_5_0)
+    control = str(stream.readQString())     ### flag C/S
+    wvm = str(stream.readQString())
+    command = str(stream.readQString())     ### command of 3 or 4 characters
+    data = list(stream.readQVariantList())   ### data
+    return [control, wvm, command, data]
+
+class AsyncCommHandler():
+    """ Handles the connection of a single client in the event loop of AsyncServer. """
+    high_water_mark = 1 << 20
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.controller = server.controller
+        self.reader = reader
+        self.writer = writer
+        self.user_name = ""
+        self.nameDuplicate = 0
+        self.extended_frame = False
+        self.closed = False
+
+        self._outbound = OutboundQueue(self.high_water_mark, bytes)
+        self._flush_event = asyncio.Event()
+        self.bytes_sent = 0
+        self.messages_sent = 0
+
+        self.writer.transport.set_write_buffer_limits(high=self.high_water_mark)
+
+    def toMessageList(self, message):
+        """ Encode the message and put it into the outbound queue. Thread-safe. """
+        if self.closed:
+            return
+        if self._outbound.put(message, self.extended_frame):
+            self.server.call_soon(self._flush_event.set)
+
+    async def _write_loop(self):
+        """ Write all pending messages at once whenever the queue is woken up, and wait
+            for the socket to drain before writing the next batch.
+        """
+        while not self.closed:
+            await self._flush_event.wait()
+            self._flush_event.clear()
+            self._write_pending()
+            await self.writer.drain()
+
+    def _write_pending(self):
+        frames = self._outbound.take()
+        if not frames:
+            return
+        buffer = b''.join(frames)
+        self.writer.write(buffer)
+        self.bytes_sent += len(buffer)
+        self.messages_sent += len(frames)
+
+    async def _read_message(self):
+        header = await self.reader.readexactly(2)
+        block_size = int.from_bytes(header, 'big')
+        if block_size == FRAME_EXTENDED:
+            ### 32-bit length follows the extended frame marker
+            block_size = int.from_bytes(await self.reader.readexactly(4), 'big')
+        return decode_message(await self.reader.readexactly(block_size))
+
+    async def serve(self):
+        writer_task = asyncio.ensure_future(self._write_loop())
+        disconnected = False
+        command = ''
+        try:
+            while True:
+                control, wvm, command, data = await self._read_message()
+                if wvm == 'SRV':
+                    continue
+                elif wvm != 'WVM':
+                    # todo - exception
+                    break
+
+                if control == 'C' and command == 'CON':
+                    if not data or not isinstance(data[0], str):
+                        ### The client cannot be named
+                        self.toMessageList(['C', 'WVM', 'NAK', [command]])
+                        break
+                    self.user_name, self.nameDuplicate = self.server.fixUserName(self, data[0])
+                    ### The controller knows the client by the name without duplicates
+                    data = [self.user_name] + data[1:]
+                    if len(data) > 1 and 'L32' in data[1]:
+                        self.extended_frame = True
+                        self.toMessageList(['C', 'WVM', 'FRM', [FRAME_VERSION]])
+                elif control == 'C' and command == 'DCN':
+                    self.controller.toWorkList([control, command, data, self])
+                    disconnected = True
+                    break
+                self.controller.toWorkList([control, command, data, self])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as err:
+            print("[Async server] Malformed message from", self.user_name or "a new client", "-", command, err)
+            self.toMessageList(['C', 'WVM', 'NAK', [command]])
+        finally:
+            if not disconnected and self.user_name:
+                ### The connection is lost without DCN. Unsubscribe the client anyway.
+                self.controller.toWorkList(['C', 'DCN', [self.user_name], self])
+            writer_task.cancel()
+            if not self.writer.is_closing():
+                ### Send what is left, e.g. the NAK of the malformed message, before closing
+                self._write_pending()
+            self.closed = True
+            self.writer.close()
+            self.server.delete_client(self)
+
+    def statistics(self):
+        """ Return the outbound queue metrics of the client. """
+        statistics = self._outbound.statistics()
+        statistics.update({
+            'socket bytes': self.writer.transport.get_write_buffer_size(),
+            'bytes sent': self.bytes_sent,
+            'messages sent': self.messages_sent
+        })
+        return statistics
+
+class AsyncServer():
+    def __init__(self, controller, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.controller = controller
+        self.host = host
+        self.port = port
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._client_list = []
+
+    async def open_session(self):
+        """ Start listening in the running event loop. """
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_new_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close_session(self):
+        self._server.close()
+        await self._server.wait_closed()
+        for client in list(self._client_list):
+            client.writer.close()
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.open_session()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self):
+        """ Run the server in a daemon thread and return once it listens. If it fails to
+            listen, e.g. as the port is in use, the error is raised here.
+        """
+        listening = threading.Event()
+        startup_errors = []
+
+        async def serve():
+            try:
+                await self.open_session()
+            except Exception as err:
+                startup_errors.append(err)
+                return
+            finally:
+                ### Never leave the caller waiting
+                listening.set()
+
+            try:
+                await self.serve_forever()
+            except asyncio.CancelledError:
+                ### Closed by stop
+                pass
+
+        self._thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+        self._thread.start()
+        listening.wait()
+        if startup_errors:
+            self._thread.join()
+            raise startup_errors[0]
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.close_session(), self.loop).result()
+
+    def call_soon(self, callback, *args):
+        """ Run callback in the event loop from any thread. """
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            ### The event loop is closed
+            pass
+
+    async def _handle_new_client(self, reader, writer):
+        client = AsyncCommHandler(self, reader, writer)
+        self._client_list.append(client)
+        try:
+            await client.serve()
+        except asyncio.CancelledError:
+            ### The event loop is shut down. serve has closed the connection.
+            pass
+
+    def delete_client(self, client):
+        if client in self._client_list:
+            self._client_list.remove(client)
+
+    def fixUserName(self, client, userName):
+        flagDuplicate = True
+        index = 0
+
+        while flagDuplicate:
+            flagDuplicate = False
+            for other in self._client_list:
+                if other != client and other.user_name == userName:
+                    flagDuplicate = True
+                    index += 1
+                    userName = userName + "(" + str(index) + ")"
+        return userName, index
+
+if __name__ == "__main__":
+    from wavemeter_controller import WavemeterController
+
+    host = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_HOST
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT
+    server = AsyncServer(WavemeterController(), host, port)
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,49 @@
+""" Micro-benchmark of the encoding of the messages broadcast to the clients.
+
+    Compares encoding the message for each subscribed client, as CommHandler
+    did before, with EncodedMessage, which encodes the message once and hands
+    the same frame to every client. The cost per message is measured for a
+    growing number of subscribers, for a single channel measurement (CFR) and
+    for a batched scan cycle of 8 channels (CFB).
+"""
+
+import time
+
+from message_frame import EncodedMessage, encode_message
+
+NUM_MESSAGES = 2000
+
+def cfr_message(index):
+    return ['D', 'WVM', 'CFR', ['369A', 811.28878 + index * 1e-9]]
+
+def cfb_message(index):
+    return ['D', 'WVM', 'CFB', [['CH' + str(channel), 811.28878 + index * 1e-9, 0.5, 0.1, 0.01, 0.001, \
+        1700000000.0 + index] for channel in range(8)]]
+
+def measure_per_client(make_message, num_clients):
+    messages = [make_message(index) for index in range(NUM_MESSAGES)]
+    start = time.perf_counter()
+    for message in messages:
+        for _ in range(num_clients):
+            encode_message(message)
+    return 1e6 * (time.perf_counter() - start) / NUM_MESSAGES
+
+def measure_shared(make_message, num_clients):
+    messages = [make_message(index) for index in range(NUM_MESSAGES)]
+    start = time.perf_counter()
+    for message in messages:
+        message = EncodedMessage(message)
+        for _ in range(num_clients):
+            message.frame()
+    return 1e6 * (time.perf_counter() - start) / NUM_MESSAGES
+
+def main():
+    for name, make_message in (('CFR', cfr_message), ('CFB', cfb_message)):
+        assert encode_message(make_message(0)) == EncodedMessage(make_message(0)).frame()
+        for num_clients in (1, 4, 16, 64, 256):
+            print("[Benchmark] %s - %3d clients : %8.1f us per message (per client), %6.1f us (shared)" \
+                % (name, num_clients, measure_per_client(make_message, num_clients), \
+                measure_shared(make_message, num_clients)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+""" Micro-benchmark of the message dispatch of WavemeterController.
+
+    Compares the former if/elif chain of WavemeterController.run with the
+    CommandTable lookup. Both call the same stub handlers, so the difference
+    is the cost of the dispatch itself in the controller thread. The data is
+    validated against the schema in toWorkList, i.e. in the thread receiving
+    the message, which the if/elif chain never did. Its cost is reported
+    separately. The cost of the chain grows with the position of the command
+    in it, while the table lookup does not depend on the command. For the
+    command at the head of the chain (CON), the table is not faster, and it can
+    be slower by up to about 15%, as the chain pays only two comparisons there.
+    Each figure is the best of NUM_ROUNDS rounds.
+"""
+
+import time
+
+from command_table import CommandTable
+from manual_server_test import VirtualSocket
+
+NUM_ROUNDS = 5
+
+class StubHandlers():
+    def __init__(self):
+        self.num_calls = 0
+
+    def __call__(self, *args):
+        self.num_calls += 1
+
+def legacy_dispatch(work, stub):
+    control = work[0]
+    command = work[1]
+    data = work[2]
+    client_handler = work[3]
+
+    if control == 'C':
+        if command == 'CON':
+            stub(data[0], client_handler)
+        elif command == 'DCN':
+            pass
+        elif command == 'SRT':
+            stub(data[0], client_handler)
+        elif command == 'STP':
+            stub()
+        elif command == 'KIL':
+            stub()
+        elif command == 'UON':
+            stub([data[0]], client_handler)
+        elif command == 'UOF':
+            stub(data[0], client_handler)
+        elif command == 'PON':
+            stub(data[0], client_handler)
+        elif command == 'POF':
+            stub(data[0], client_handler)
+        elif command == 'FON':
+            stub(data[0], client_handler)
+        elif command == 'FOF':
+            stub(data[0], client_handler)
+        elif command == 'AEN':
+            stub(data[0], client_handler)
+        elif command == 'AEF':
+            stub(data[0], client_handler)
+        elif command == 'WMS':
+            stub(client_handler)
+        elif command == 'SCF':
+            stub(data[0])
+        elif command == 'CAL':
+            pass
+        elif command == 'ACL':
+            pass
+        elif command == 'NAK':
+            pass
+    elif control == 'D':
+        if command == 'TWL':
+            stub(data[0], data[1])
+        elif command == 'TFR':
+            stub(data[0], data[1])
+        elif command == 'EXP':
+            stub(data[0], data[1])
+        elif command == 'VLT':
+            stub(data[0], data[1])
+        elif command == 'PPP':
+            stub(data[0], data[1])
+        elif command == 'III':
+            stub(data[0], data[1])
+        elif command == 'DDD':
+            stub(data[0], data[1])
+        elif command == 'GAN':
+            stub(data[0], data[1])
+
+def build_table(stub):
+    table = CommandTable()
+    for command in ('CON', 'SCF', 'UON', 'UOF', 'PON', 'POF', 'FON', 'FOF', 'AEN', 'AEF'):
+        table.register('C', command, (str,), stub)
+    table.register('C', 'SRT', (list,), stub)
+    for command in ('STP', 'KIL', 'WMS', 'DCN', 'NAK'):
+        table.register('C', command, (), stub)
+    for command in ('TWL', 'TFR', 'VLT'):
+        table.register('D', command, (str, float), stub)
+    for command in ('EXP', 'PPP', 'III', 'DDD', 'GAN'):
+        table.register('D', command, (str, int), stub)
+    return table
+
+def build_messages(virtual_socket):
+    """ Mixture of messages weighted towards the parameter updates at the end of the chain """
+    messages = [
+        ['C', 'CON', [virtual_socket.user_name], virtual_socket],
+        ['C', 'UON', ['369A'], virtual_socket],
+        ['C', 'PON', ['369A'], virtual_socket],
+        ['C', 'AEF', ['369A'], virtual_socket],
+        ['C', 'STP', [], virtual_socket]
+    ]
+    for command in ('TFR', 'VLT'):
+        messages.append(['D', command, ['369A', 811.28878], virtual_socket])
+    for command in ('PPP', 'III', 'DDD', 'GAN'):
+        messages.append(['D', command, ['369A', 5], virtual_socket])
+    return messages
+
+def measure(dispatch, messages, repeat):
+    best_time = None
+    for _ in range(NUM_ROUNDS):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for message in messages:
+                dispatch(message)
+        elapsed = time.perf_counter() - start
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time
+
+def main(repeat=100000):
+    virtual_socket = VirtualSocket()
+    messages = build_messages(virtual_socket)
+    num_messages = repeat * len(messages)
+
+    legacy_stub = StubHandlers()
+    legacy_time = measure(lambda work: legacy_dispatch(work, legacy_stub), messages, repeat)
+
+    table_stub = StubHandlers()
+    table = build_table(table_stub)
+    ### Bound once, as in WavemeterController.run
+    dispatch = table.dispatch
+    table_time = measure(lambda work: dispatch(work[0], work[1], work[2], work[3]), messages, repeat)
+
+    assert legacy_stub.num_calls == table_stub.num_calls == NUM_ROUNDS * num_messages
+    print("[Benchmark] Mixed messages  - if/elif chain : %.0f msg/s, command table : %.0f msg/s" \
+        % (num_messages / legacy_time, num_messages / table_time))
+
+    ### Single command at the head and at the tail of the chain
+    for message in (messages[0], messages[-1]):
+        legacy_time = measure(lambda work: legacy_dispatch(work, legacy_stub), [message], repeat)
+        table_time = measure(lambda work: dispatch(work[0], work[1], work[2], work[3]), [message], repeat)
+        print("[Benchmark] %s%s only      - if/elif chain : %.0f msg/s, command table : %.0f msg/s" \
+            % (message[0], message[1], repeat / legacy_time, repeat / table_time))
+
+    ### Cost added to the receiving thread
+    validate = table.validate
+    validate_time = measure(lambda work: validate(work[0], work[1], work[2]), messages, repeat)
+    print("[Benchmark] Validation of mixed messages in toWorkList : %.0f msg/s" \
+        % (num_messages / validate_time))
+
+if __name__ == "__main__":
+    main()
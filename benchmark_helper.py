@@ -0,0 +1,47 @@
+""" Helpers shared by the benchmarks running WavemeterController on a synthetic
+    configuration instead of a configuration file.
+"""
+
+from wavemeter_controller import WavemeterController, Channel
+
+EXPOSURE_TIME = 5   # ms
+PID_PARAMETERS = [5, 18, 0, -1]
+
+class MessageSink():
+    """ Client counting the messages sent to it """
+    def __init__(self):
+        self.user_name = 'benchmark'
+        self.num_messages = 0
+
+    def toMessageList(self, message):
+        self.num_messages += 1
+
+class BenchmarkController(WavemeterController):
+    """ Controller with the synthetic configuration. Subclasses give the channels with
+        channel_layout, and may set the clock and the backend before calling _open_config.
+    """
+    switch_safe_time = 30   # ms
+
+    def channel_layout(self):
+        """ Return the list of (fiber switch, target frequency) of the channels. """
+        return []
+
+    def _open_config(self):
+        self.switch_safe = self.switch_safe_time
+        self.auto_exposure_step = 1.2
+        self.max_frequency_offset = 100e-6
+        self.max_frequency_change = 30e-6
+        self.log_enabled = False
+
+        for index, (fiber_switch, target_frequency) in enumerate(self.channel_layout()):
+            name = 'CH' + str(index)
+            self._channel_list_prio_low[name] = Channel(name, EXPOSURE_TIME, PID_PARAMETERS, \
+                fiber_switch, index, target_frequency, clock=self.clock)
+
+    def run_cycles_here(self):
+        """ Let the calling thread run the cycles of the PID loop. The thread of the PID loop
+            is kept waiting on the mutex. Return the PID loop.
+        """
+        self.pid_loop.mutex.lock()
+        self.pid_loop.is_running = True
+        return self.pid_loop
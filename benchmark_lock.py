@@ -0,0 +1,126 @@
+""" Benchmark of the lock acquisition and the long term stability of PIDLoop with
+    the simulated wavemeter on the virtual clock.
+
+    Every channel starts away from its target frequency and drifts. For the lock
+    acquisition, the PID loop runs without the cycle padding until the measured
+    frequency of every channel stays within LOCK_THRESHOLD of the target for
+    LOCK_COUNT measurements in a row. For the stability, the loop runs the padded
+    cycles of the round robin scheduler for STABILITY_HOURS of virtual time.
+
+    The simulator is seeded and the virtual clock does not depend on the load of
+    the machine, so the simulated results of a seed are reproducible.
+"""
+
+import time
+
+import numpy as np
+
+from channel_scheduler import AdaptiveScheduler, RoundRobinScheduler
+from clock import VirtualClock
+from benchmark_helper import BenchmarkController, MessageSink, EXPOSURE_TIME
+
+SWITCH_SAFE = 10        # ms
+SWITCH_DELAY = 10       # ms
+LOCK_THRESHOLD = 1e-6   # THz
+LOCK_COUNT = 5
+TIMEOUT = 600           # s of virtual time
+STABILITY_HOURS = 24
+
+class LockController(BenchmarkController):
+    """ Controller with the synthetic configuration on the simulated wavemeter """
+    switch_safe_time = SWITCH_SAFE
+    num_channels = 2
+    seed = 0
+    scheduler_class = AdaptiveScheduler
+
+    def channel_layout(self):
+        return [(index, 811.28878 + index * 1e-3) for index in range(self.num_channels)]
+
+    def _open_config(self):
+        self.clock = VirtualClock()
+        self.clock_name = 'virtual'
+        self.backend_name = 'simulator'
+        self.simulator_seed = self.seed
+        super()._open_config()
+        self.pid_loop.scheduler = self.scheduler_class(self)
+
+def start_controller(num_channels, seed, scheduler_class):
+    LockController.num_channels = num_channels
+    LockController.seed = seed
+    LockController.scheduler_class = scheduler_class
+    controller = LockController()
+    controller.wavemeter.switch_delay = SWITCH_DELAY
+    controller.wavemeter.WM.switchDelay = SWITCH_DELAY
+
+    sink = MessageSink()
+    controller._new_connection(sink.user_name, sink)
+    channels = list(controller._channel_list_prio_low.values())
+    for channel_obj in channels:
+        channel_obj.add_monitor_client(sink.user_name)
+        controller._pid_on(channel_obj.name)
+
+    controller.run_cycles_here()
+    return controller, channels
+
+def measure_lock(num_channels, seed):
+    """ Return the virtual time to lock, or None, and the wall clock time of the run. """
+    controller, channels = start_controller(num_channels, seed, AdaptiveScheduler)
+    clock = controller.clock
+    in_lock = {channel_obj.name: 0 for channel_obj in channels}
+
+    start = clock.time()
+    wall_start = time.perf_counter()
+    lock_time = None
+    while clock.time() - start < TIMEOUT:
+        controller.pid_loop.run_cycle()
+        for channel_obj in channels:
+            if channel_obj.current_frequency > 0 and \
+                abs(channel_obj.current_frequency - channel_obj.target_frequency) < LOCK_THRESHOLD:
+                in_lock[channel_obj.name] += 1
+            else:
+                in_lock[channel_obj.name] = 0
+        if min(in_lock.values()) >= LOCK_COUNT:
+            lock_time = clock.time() - start
+            break
+    return lock_time, time.perf_counter() - wall_start
+
+def measure_stability(num_channels, seed, hours):
+    """ Return the RMS and the maximum of the frequency error in lock, the number of
+        measurements and the wall clock time of the run.
+    """
+    controller, channels = start_controller(num_channels, seed, RoundRobinScheduler)
+    clock = controller.clock
+
+    errors = []
+    end = clock.time() + 3600 * hours
+    wall_start = time.perf_counter()
+    while clock.time() < end:
+        controller.pid_loop.run_cycle()
+        errors.extend(channel_obj.current_frequency - channel_obj.target_frequency \
+            for channel_obj in channels if channel_obj.current_frequency > 0)
+    wall_time = time.perf_counter() - wall_start
+
+    ### The first minute is the lock acquisition
+    errors = np.array(errors[60 * num_channels:])
+    return np.sqrt(np.mean(errors ** 2)), np.max(np.abs(errors)), len(errors), wall_time
+
+def main(seeds=(0, 1, 2)):
+    print("[Benchmark] exposure %d ms, switch safe %d ms, switch delay %d ms, lock within %.1f MHz" \
+        % (EXPOSURE_TIME, SWITCH_SAFE, SWITCH_DELAY, LOCK_THRESHOLD * 1e6))
+    for num_channels in (1, 2, 4):
+        for seed in seeds:
+            lock_time, wall_time = measure_lock(num_channels, seed)
+            if lock_time is None:
+                print("[Benchmark] %d channels, seed %d - no lock in %d s (%.2f s wall clock)" \
+                    % (num_channels, seed, TIMEOUT, wall_time))
+            else:
+                print("[Benchmark] %d channels, seed %d - lock in %.2f s (%.2f s wall clock)" \
+                    % (num_channels, seed, lock_time, wall_time))
+
+    rms, maximum, num_measurements, wall_time = measure_stability(2, seeds[0], STABILITY_HOURS)
+    print("[Benchmark] %d h of 2 channels, seed %d - RMS error %.3f MHz, max error %.3f MHz, " \
+        "%d measurements in %.1f s wall clock" % (STABILITY_HOURS, seeds[0], rms * 1e6, maximum * 1e6, \
+        num_measurements, wall_time))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+""" Micro-benchmark of PIDCore.
+
+    Measures the channel updates per second of step() on PIDState and of
+    step_many() on PIDArrays of a growing number of channels, after checking
+    that both give the same outputs for the same measurements.
+"""
+
+import time
+
+import numpy as np
+
+from pid_core import PIDCore, PIDState, PIDArrays
+
+TARGET_FREQUENCY = 811.28878
+NUM_MEASUREMENTS = 1000
+
+def measurements(num_channels, seed=0):
+    rng = np.random.default_rng(seed)
+    return TARGET_FREQUENCY + 1e-6 * rng.standard_normal((NUM_MEASUREMENTS, num_channels)).cumsum(axis=0)
+
+def check_consistency(core, num_channels=8):
+    frequencies = measurements(num_channels)
+    states = [PIDState(5, 18, 1, -1, TARGET_FREQUENCY) for _ in range(num_channels)]
+    arrays = PIDArrays(5, 18, 1, -1, np.full(num_channels, TARGET_FREQUENCY))
+    for row in frequencies:
+        outputs = [core.step(state, frequency, 0.1) for state, frequency in zip(states, row)]
+        assert np.allclose(outputs, core.step_many(arrays, row, 0.1), rtol=1e-9, atol=1e-15)
+
+def measure_step(core):
+    frequencies = measurements(1)[:, 0].tolist()
+    state = PIDState(5, 18, 1, -1, TARGET_FREQUENCY)
+    step = core.step
+    start = time.perf_counter()
+    for frequency in frequencies:
+        step(state, frequency, 0.1)
+    return len(frequencies) / (time.perf_counter() - start)
+
+def measure_step_many(core, num_channels):
+    frequencies = measurements(num_channels)
+    arrays = PIDArrays(5, 18, 1, -1, np.full(num_channels, TARGET_FREQUENCY))
+    start = time.perf_counter()
+    for row in frequencies:
+        core.step_many(arrays, row, 0.1)
+    return frequencies.size / (time.perf_counter() - start)
+
+def main():
+    core = PIDCore(100e-6, 30e-6, -10.0, 10.0)
+    check_consistency(core)
+    print("[Benchmark] step      - 1 channel     : %.0f updates/s" % measure_step(core))
+    for num_channels in (1, 16, 1024, 65536):
+        print("[Benchmark] step_many - %5d channels : %.0f updates/s" \
+            % (num_channels, measure_step_many(core, num_channels)))
+
+if __name__ == "__main__":
+    main()
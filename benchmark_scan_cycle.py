@@ -0,0 +1,55 @@
+""" Regression benchmark of the scan cycle time of PIDLoop with DummyWavemeter.
+
+    Two channels are monitored while the number of idle channels in the
+    configuration grows. Idle channels should not add to the cycle time, and
+    the fiber switch safety margin should be paid only when the switch moves.
+    In the switcher mode, the switcher of the wavemeter cycles through the
+    channels on its own and the results are read at once, without the safety
+    margin. The cycle padding to 1 s is not included in the measured time.
+"""
+
+import time
+
+from benchmark_helper import BenchmarkController, MessageSink, EXPOSURE_TIME
+
+SWITCH_SAFE = 30    # ms
+
+class ScanCycleController(BenchmarkController):
+    """ Two monitored channels followed by the idle ones on DummyWavemeter """
+    switch_safe_time = SWITCH_SAFE
+    num_idle_channels = 0
+
+    def channel_layout(self):
+        return [(index % 9, 811.28878) for index in range(2 + self.num_idle_channels)]
+
+def measure_cycle_time(num_idle_channels, active_switches, num_cycles, switcher_mode=False):
+    ScanCycleController.num_idle_channels = num_idle_channels
+    controller = ScanCycleController()
+    controller.wavemeter.switch_delay = 10
+    controller.switcher_mode = switcher_mode
+
+    sink = MessageSink()
+    controller._new_connection(sink.user_name, sink)
+    channel_names = list(controller._channel_list_prio_low.keys())
+    for channel_name in channel_names[-2:]:
+        channel_obj = controller._channel_list_prio_low[channel_name]
+        channel_obj.fiber_switch = active_switches.pop(0)
+        channel_obj.add_monitor_client(sink.user_name)
+
+    pid_loop = controller.run_cycles_here()
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        pid_loop._scan_cycle()
+    return 1000 * (time.perf_counter() - start) / num_cycles
+
+def main(num_cycles=10):
+    print("[Benchmark] switch safe %d ms, switch delay 10 ms, exposure %d ms" % (SWITCH_SAFE, EXPOSURE_TIME))
+    for num_idle_channels in (0, 2, 4, 6):
+        different = measure_cycle_time(num_idle_channels, [0, 1], num_cycles)
+        shared = measure_cycle_time(num_idle_channels, [0, 0], num_cycles)
+        switcher = measure_cycle_time(num_idle_channels, [0, 1], num_cycles, True)
+        print("[Benchmark] %d idle channels - cycle time %.1f ms (2 switch positions), %.1f ms (1 switch position), " \
+            "%.1f ms (switcher mode)" % (num_idle_channels, different, shared, switcher))
+
+if __name__ == "__main__":
+    main()
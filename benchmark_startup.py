@@ -0,0 +1,67 @@
+""" Benchmark of the cold start of the headless server.
+
+    Starts wavemeter_server.py in a new interpreter and measures the time
+    until it reports the listening socket and a client connected to it gets
+    the reply of CON. For reference, the time to import the Qt modules which
+    the headless server no longer loads (QtWidgets, QtNetwork) is measured in
+    a new interpreter as well.
+"""
+
+import os
+import sys
+import time
+import socket
+import subprocess
+import statistics
+
+from async_server import decode_message
+from message_frame import encode_message
+
+_home_dir = os.path.dirname(os.path.realpath(__file__))
+CONFIG_FILE = os.path.join(_home_dir, 'config', 'original.ini')
+NUM_RUNS = 5
+
+def measure_cold_start(backend):
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(_home_dir, 'wavemeter_server.py'), \
+        '--config', CONFIG_FILE, '--backend', backend, '--port', '0'], stdout=subprocess.PIPE, \
+        stderr=subprocess.DEVNULL, text=True, cwd=_home_dir)
+    try:
+        for line in process.stdout:
+            if 'Listening on' in line:
+                break
+        else:
+            raise RuntimeError("The server exited before listening")
+        listening = time.perf_counter() - start
+
+        port = int(line.split()[4].split(':')[1])
+        with socket.create_connection(('127.0.0.1', port)) as client:
+            client.sendall(bytes(encode_message(['C', 'WVM', 'CON', ['benchmark']])))
+            block_size = int.from_bytes(client.recv(2, socket.MSG_WAITALL), 'big')
+            assert decode_message(client.recv(block_size, socket.MSG_WAITALL))[2] == 'STA'
+        first_reply = time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+    return listening, first_reply
+
+def measure_import(module_names):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import ' + ', '.join(module_names)], check=True)
+    return time.perf_counter() - start
+
+def main():
+    for backend in ('dummy', 'simulator'):
+        results = [measure_cold_start(backend) for _ in range(NUM_RUNS)]
+        print("[Benchmark] %-9s - listening %.0f ms, first reply %.0f ms (median of %d)" % (backend, \
+            1000 * statistics.median(result[0] for result in results), \
+            1000 * statistics.median(result[1] for result in results), NUM_RUNS))
+
+    core = statistics.median(measure_import(['PyQt5.QtCore']) for _ in range(NUM_RUNS))
+    gui = statistics.median(measure_import(['PyQt5.QtCore', 'PyQt5.QtWidgets', 'PyQt5.QtNetwork']) \
+        for _ in range(NUM_RUNS))
+    print("[Benchmark] interpreter with QtCore %.0f ms, with QtWidgets and QtNetwork %.0f ms" \
+        % (1000 * core, 1000 * gui))
+
+if __name__ == "__main__":
+    main()
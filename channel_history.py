@@ -0,0 +1,87 @@
+""" Time-series history of a channel.
+
+    Measurements are kept in a fixed-size ring buffer of float64 records, so
+    appending costs O(1) and the memory does not grow. Queries return NumPy
+    arrays of a time window, either as raw records or reduced to min/max/mean
+    per time bucket, which are sent to the clients as binary data.
+"""
+
+import numpy as np
+from PyQt5.QtCore import QMutex
+
+### Fields of a record, in order
+HISTORY_FIELDS = ('time', 'frequency', 'output voltage', 'exposure time', \
+    'accumulator', 'proportional', 'differentiator')
+
+DEFAULT_HISTORY_SIZE = 4096
+
+class ChannelHistory():
+    def __init__(self, capacity=DEFAULT_HISTORY_SIZE):
+        self.capacity = capacity
+        self._records = np.zeros((capacity, len(HISTORY_FIELDS)), dtype=np.float64)
+        self._next = 0
+        self._count = 0
+        self._mutex = QMutex()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, measured_time, frequency, output_voltage, exposure_time, \
+        accumulator, proportional, differentiator):
+        self._mutex.lock()
+        record = self._records[self._next]
+        record[0] = measured_time
+        record[1] = frequency
+        record[2] = output_voltage
+        record[3] = exposure_time
+        record[4] = accumulator
+        record[5] = proportional
+        record[6] = differentiator
+
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+        self._mutex.unlock()
+
+    def window(self, start_time, end_time):
+        """ Return the records measured in [start_time, end_time] in the order of time as an
+            array of shape (number of records, number of fields).
+        """
+        self._mutex.lock()
+        try:
+            first = (self._next - self._count) % self.capacity
+            if first + self._count <= self.capacity:
+                records = self._records[first:first + self._count]
+            else:
+                ### Only the wrapped history is copied to make it contiguous
+                records = np.concatenate((self._records[first:], self._records[:self._next]))
+
+            times = records[:, 0]
+            begin = np.searchsorted(times, start_time, side='left')
+            end = np.searchsorted(times, end_time, side='right')
+            return records[begin:end].copy()
+        finally:
+            self._mutex.unlock()
+
+    def downsample(self, start_time, end_time, num_buckets):
+        """ Split [start_time, end_time] into num_buckets buckets of the same duration and
+            reduce the records of each non-empty bucket into a row of
+            [ bucket start time | (min, max, mean) of each field except time ].
+        """
+        records = self.window(start_time, end_time)
+        if not len(records) or num_buckets < 1 or end_time <= start_time:
+            return np.zeros((0, 1 + 3 * (len(HISTORY_FIELDS) - 1)))
+
+        edges = start_time + (end_time - start_time) * np.arange(num_buckets) / num_buckets
+        starts = np.searchsorted(records[:, 0], edges, side='left')
+        non_empty = np.append(starts[1:], len(records)) > starts
+        starts = starts[non_empty]
+        counts = np.diff(np.append(starts, len(records)))
+
+        values = records[:, 1:]
+        minimum = np.minimum.reduceat(values, starts, axis=0)
+        maximum = np.maximum.reduceat(values, starts, axis=0)
+        mean = np.add.reduceat(values, starts, axis=0) / counts[:, np.newaxis]
+
+        reduced = np.stack((minimum, maximum, mean), axis=2).reshape(len(starts), -1)
+        return np.hstack((edges[non_empty][:, np.newaxis], reduced))
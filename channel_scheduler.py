@@ -0,0 +1,105 @@
+""" Schedulers deciding which channels PIDLoop measures in each scan cycle.
+
+    A scheduler returns the list of (channel_name, Channel object) to measure
+    in the next cycle. Channels without monitoring clients are never scheduled,
+    so they cost no time. The channels of a cycle are ordered by the position of
+    the fiber switch, starting from its current position, so that the switch
+    moves as little as possible.
+
+    1. RoundRobinScheduler : Every monitored channel once per cycle. The cycle
+      is padded to 1 s.
+    2. AdaptiveScheduler : Slots of a cycle are shared by weight. PID locked
+      channels with large recent error get more slots, and channels which have
+      not been measured within the period of their minimum update rate are
+      measured first. The cycle is not padded.
+"""
+
+NUM_SWITCH_POSITIONS = 9
+
+def order_by_switch(schedule, switch_position=None):
+    """ Sort the schedule by the fiber switch position in the circular order starting from
+        switch_position, so that channels at the same position are measured in a row and the
+        last channel of a cycle is the first one of the next cycle. Channels at the same
+        position keep their order.
+    """
+    if not schedule:
+        return schedule
+
+    if switch_position is None:
+        switch_position = min(channel_obj.fiber_switch for _, channel_obj in schedule)
+    return sorted(schedule, \
+        key=lambda item: (item[1].fiber_switch - switch_position) % NUM_SWITCH_POSITIONS)
+
+class RoundRobinScheduler():
+    pad_cycle = True
+
+    def __init__(self, controller=None):
+        self.controller = controller
+
+    def schedule(self, channel_list, now, switch_position=None):
+        return order_by_switch([(channel_name, channel_obj) for channel_name, channel_obj \
+            in channel_list.items() if channel_obj.monitor_list], switch_position)
+
+class AdaptiveScheduler():
+    pad_cycle = False
+
+    def __init__(self, controller=None, max_weight=8.0):
+        """ controller provides max_frequency_offset, the error at which a locked channel
+            reaches max_weight. Unlocked channels have the weight of 1.
+        """
+        self.controller = controller
+        self.max_weight = max_weight
+        self._pass = {}
+
+    def _weight(self, channel_obj):
+        if not channel_obj.pid_on or self.controller is None or self.controller.max_frequency_offset <= 0:
+            return 1.0
+
+        error = abs(channel_obj.weighted_frequency - channel_obj.target_frequency)
+        ratio = min(error / self.controller.max_frequency_offset, 1.0)
+        return 2.0 + (self.max_weight - 2.0) * ratio
+
+    def schedule(self, channel_list, now, switch_position=None):
+        """ Share one slot per monitored channel by stride scheduling. Each channel keeps a
+            pass value which advances by 1/weight whenever it gets a slot, and the slot goes
+            to the channel of the smallest pass.
+        """
+        monitored = [(channel_name, channel_obj) for channel_name, channel_obj in channel_list.items() \
+            if channel_obj.monitor_list]
+        if not monitored:
+            self._pass = {}
+            return []
+
+        ### Forget the channels that are not monitored anymore and let the new ones start
+        ### from the current minimum pass so that they don't monopolize the slots.
+        self._pass = {channel_name: self._pass[channel_name] for channel_name, _ in monitored \
+            if channel_name in self._pass}
+        base_pass = min(self._pass.values()) if self._pass else 0.0
+        for channel_name, _ in monitored:
+            self._pass.setdefault(channel_name, base_pass)
+
+        schedule = []
+        ### Channels overdue for their minimum update rate come first
+        for channel_name, channel_obj in monitored:
+            if channel_obj.min_update_rate > 0 and \
+                now - channel_obj.current_time >= 1.0 / channel_obj.min_update_rate:
+                schedule.append((channel_name, channel_obj))
+                self._pass[channel_name] += 1.0 / self._weight(channel_obj)
+
+        weights = {channel_name: self._weight(channel_obj) for channel_name, channel_obj in monitored}
+        channels = dict(monitored)
+        while len(schedule) < len(monitored):
+            channel_name = min(self._pass, key=self._pass.get)
+            schedule.append((channel_name, channels[channel_name]))
+            self._pass[channel_name] += 1.0 / weights[channel_name]
+
+        ### Keep the pass values small
+        base_pass = min(self._pass.values())
+        for channel_name in self._pass:
+            self._pass[channel_name] -= base_pass
+        return order_by_switch(schedule, switch_position)
+
+SCHEDULERS = {
+    'round robin': RoundRobinScheduler,
+    'adaptive': AdaptiveScheduler
+}
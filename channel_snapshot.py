@@ -0,0 +1,35 @@
+""" Immutable snapshots of the state of the channels.
+
+    PIDLoop owns the Channel objects. After each cycle, and after applying the
+    commands posted to it, it builds a StateSnapshot and publishes it by
+    replacing WavemeterController.snapshot. Assigning the attribute is atomic,
+    so the readers in other threads take the latest snapshot without a lock,
+    and the snapshot never changes while they read it.
+"""
+
+from collections import namedtuple
+from types import MappingProxyType
+
+CHANNEL_SNAPSHOT_FIELDS = ('name', 'fiber_switch', 'dac_channel', 'target_frequency', 'current_frequency', \
+    'weighted_frequency', 'output_voltage', 'exposure_time', 'pp', 'ii', 'dd', 'gain', 'accumulator', \
+    'proportional', 'differentiator', 'pid_on', 'auto_exposure_on', 'measured_time', 'update_rate', \
+    'min_update_rate', 'monitor_list')
+
+ChannelSnapshot = namedtuple('ChannelSnapshot', CHANNEL_SNAPSHOT_FIELDS)
+
+### channels : read-only mapping of (channel name, ChannelSnapshot)
+StateSnapshot = namedtuple('StateSnapshot', ('cycle', 'time', 'server_status', 'channels'))
+
+def snapshot_channel(channel_obj):
+    pid_state = channel_obj.pid_state
+    return ChannelSnapshot(channel_obj.name, channel_obj.fiber_switch, channel_obj.DAC_channel, \
+        pid_state.target_frequency, channel_obj.current_frequency, pid_state.weighted_frequency, \
+        channel_obj.current_output_voltage, channel_obj.exposure_time, pid_state.pp, pid_state.ii, \
+        pid_state.dd, pid_state.gain, pid_state.accumulator, pid_state.proportional, \
+        pid_state.differentiator, channel_obj.pid_on, channel_obj.auto_exposure_on, \
+        channel_obj.current_time, channel_obj.update_rate, channel_obj.min_update_rate, \
+        tuple(channel_obj.monitor_list))
+
+def take_snapshot(cycle, measured_time, server_status, channel_list):
+    return StateSnapshot(cycle, measured_time, server_status, MappingProxyType( \
+        {channel_name: snapshot_channel(channel_obj) for channel_name, channel_obj in channel_list.items()}))
@@ -0,0 +1,47 @@
+""" Clocks giving the time to PIDLoop, the channels and the wavemeter backends.
+
+    1. SystemClock : The wall clock. sleep blocks the thread.
+    2. VirtualClock : sleep advances the time instantly instead of blocking, so
+      the PID loop with a simulated wavemeter runs as fast as it can compute.
+      Days of locking can be simulated in seconds, and the run does not depend
+      on the load of the machine.
+"""
+
+import time
+
+from PyQt5.QtCore import QMutex
+
+class SystemClock():
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+class VirtualClock():
+    def __init__(self, start_time=None):
+        """ The virtual time starts from start_time, or from the current wall clock time so
+            that the timestamps of the measurements look familiar.
+        """
+        self._now = time.time() if start_time is None else float(start_time)
+        self._mutex = QMutex()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self._mutex.lock()
+            self._now += seconds
+            self._mutex.unlock()
+
+    def advance(self, seconds):
+        self.sleep(seconds)
+
+SYSTEM_CLOCK = SystemClock()
+
+CLOCKS = {
+    'system': SystemClock,
+    'virtual': VirtualClock
+}
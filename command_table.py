@@ -0,0 +1,98 @@
+""" Dispatch table of the messages handled by WavemeterController.
+
+    Each (control, command) pair is registered with the schema of its data
+    and the handler to call. The schema is compiled into a validating function
+    once at registration. Validation and dispatch are separate steps, so the
+    data can be checked in the thread receiving the message, and dispatching
+    a message in the controller thread costs two dictionary lookups and the
+    call of the handler.
+"""
+
+### Types accepted for each type in the schema. Integers from the network are
+### valid floating point arguments as well.
+_ACCEPTED_TYPES = {
+    str: (str,),
+    int: (int,),
+    float: (int, float),
+    list: (list, tuple)
+}
+
+def _compile_schema(schema):
+    """ Build the function checking whether data matches the schema.
+        Return None for the empty schema, which accepts any data.
+    """
+    try:
+        accepted_types = tuple(_ACCEPTED_TYPES[arg_type] for arg_type in schema)
+    except KeyError as err:
+        raise ValueError("Unsupported argument type %s" % err)
+
+    num_args = len(accepted_types)
+    if num_args == 0:
+        return None
+    elif num_args == 1:
+        type0, = accepted_types
+        def validate(data):
+            try:
+                return isinstance(data[0], type0)
+            except IndexError:
+                return False
+        return validate
+    elif num_args == 2:
+        type0, type1 = accepted_types
+        def validate(data):
+            try:
+                return isinstance(data[0], type0) and isinstance(data[1], type1)
+            except IndexError:
+                return False
+        return validate
+
+    def validate(data):
+        if len(data) < num_args:
+            return False
+        for arg, arg_types in zip(data, accepted_types):
+            if not isinstance(arg, arg_types):
+                return False
+        return True
+    return validate
+
+class CommandTable():
+    def __init__(self):
+        ### control -> command -> handler, and control -> command -> validating function
+        self._handlers = {}
+        self._validators = {}
+
+    def register(self, control, command, schema, handler):
+        """ Register handler(data, requester) for the (control, command) pair.
+            schema is the tuple of types of the leading elements of data. Additional
+            elements of data are ignored.
+        """
+        validate = _compile_schema(schema)
+        self._handlers.setdefault(control, {})[command] = handler
+        self._validators.setdefault(control, {})[command] = validate
+
+    def unregister(self, control, command):
+        self._handlers.get(control, {}).pop(command, None)
+        self._validators.get(control, {}).pop(command, None)
+
+    def is_registered(self, control, command):
+        return command in self._handlers.get(control, ())
+
+    def validate(self, control, command, data):
+        """ Return False if the command is unknown or the data does not match the schema. """
+        try:
+            validate = self._validators[control][command]
+        except KeyError:
+            return False
+        return validate is None or validate(data)
+
+    def dispatch(self, control, command, data, requester):
+        """ Call the handler registered for the message, whose data has been checked
+            with validate. Return False if the command is unknown.
+        """
+        try:
+            handler = self._handlers[control][command]
+        except KeyError:
+            return False
+
+        handler(data, requester)
+        return True
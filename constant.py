@@ -6,4 +6,8 @@
 SERVER_STATUS = {"disconnected":-1, "stopped":0, "started":1, "focused":2}
 THREAD_STATUS = {"standby":0, "running":1}
 
+WORK_PRIORITY = {"control":0, "update":1}
+
 OUT_OF_RANGE = -1
+
+WORK_QUEUE_CAPACITY = 1024
@@ -1,9 +1,11 @@
 import sys
+
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtNetwork import *
 
 from wavemeter_controller import WavemeterController
+from message_frame import FRAME_EXTENDED, FRAME_VERSION, OutboundQueue
 
 class Socket(QTcpServer):
     def __init__(self, controller):
@@ -38,7 +40,22 @@ class Socket(QTcpServer):
                 break
 
 class CommHandler(QObject):
+    """ Handles the connection of a single client.
+
+        Outgoing messages are encoded by the caller and kept in the OutboundQueue,
+        which is flushed with a single write per event loop tick. While the client
+        does not read fast enough and the unsent bytes exceed high_water_mark, the
+        queue is not flushed. Pending measurement messages are then replaced by the
+        newer sample of the same channel, and new ones are dropped if the queue
+        itself exceeds high_water_mark.
+
+        Messages larger than the 16-bit frame are sent with the extended frame to the
+        clients which negotiated it during CON, and dropped for the others.
+    """
     sig_kill_me = pyqtSignal(str)
+    sig_flush = pyqtSignal()
+
+    high_water_mark = 1 << 20
 
     def __init__(self, server_socket, com_socket, controller):
         super().__init__()
@@ -47,39 +64,76 @@ class CommHandler(QObject):
         self.controller = controller
         self.user_name = ""
         self.blockSize = 0
+        self.extendedHeader = False
+        self.extended_frame = False
         self.numFailure = 0
 
+        self._outbound = OutboundQueue(self.high_water_mark)
+        self.bytes_sent = 0
+        self.messages_sent = 0
+
         self.socket.readyRead.connect(self.receiveMSG)
+        self.socket.bytesWritten.connect(self._flush)
+        self.sig_flush.connect(self._flush, Qt.QueuedConnection)
 
     def sendMSG(self, msg):
-        block = QByteArray()
-        output = QDataStream(block, QIODevice.WriteOnly)
-        output.setVersion(QDataStream.Qt_5_0)
-
-        output.writeUInt16(0)
-        output.writeQString(msg[0])     ### flag C/S
-        output.writeQString(msg[1])
-        output.writeQString(msg[2])     ### command of 3 or 4 characters
-        output.writeQVariantList(msg[3]) ### data
-        output.device().seek(0)
-        output.writeUInt16(block.size()-2)
-        res = self.socket.write(block)
+        """ Encode the message and put it into the outbound queue. It is written to the
+            socket when the event loop of the socket handles the flush.
+        """
+        if self._outbound.put(msg, self.extended_frame):
+            self.sig_flush.emit()
+
+    def _flush(self, *args):
+        """ Write all pending messages to the socket at once. Writing is postponed
+            while the socket still holds more than high_water_mark bytes to write;
+            bytesWritten of the socket triggers the flush again.
+        """
+        if self.socket.bytesToWrite() >= self.high_water_mark:
+            return
+
+        frames = self._outbound.take()
+        if not frames:
+            return
+        buffer = QByteArray()
+        for frame in frames:
+            buffer.append(frame)
+
+        res = self.socket.write(buffer)
         if res < 0:
             self.numFailure += 1
             if self.numFailure >= 10:
                 self.sig_kill_me.emit(self.user_name)
         else:
             self.numFailure = 0
+            self.bytes_sent += res
+            self.messages_sent += len(frames)
+
+    def statistics(self):
+        """ Return the outbound queue metrics of the client. """
+        statistics = self._outbound.statistics()
+        statistics.update({
+            'socket bytes': self.socket.bytesToWrite(),
+            'bytes sent': self.bytes_sent,
+            'messages sent': self.messages_sent
+        })
+        return statistics
 
     def receiveMSG(self):
         stream = QDataStream(self.socket)
         stream.setVersion(QDataStream.Qt_5_0)
 
-        while(self.socket.bytesAvailable() >= 2):
+        while(self.socket.bytesAvailable() > 0):
             if self.blockSize == 0:
                 if self.socket.bytesAvailable() < 2:
                     return
                 self.blockSize = stream.readUInt16()
+                self.extendedHeader = (self.blockSize == FRAME_EXTENDED)
+            if self.extendedHeader:
+                ### 32-bit length follows the extended frame marker
+                if self.socket.bytesAvailable() < 4:
+                    return
+                self.blockSize = stream.readUInt32()
+                self.extendedHeader = False
             if self.socket.bytesAvailable() < self.blockSize:
                 return
             control = str(stream.readQString())     ### flag C/S
@@ -94,11 +148,15 @@ class CommHandler(QObject):
                 continue
             if control=='C' and command=='CON':
                 self.user_name, self.nameDuplicate = self.fixUserName(data[0])
+                if len(data) > 1 and 'L32' in data[1]:
+                    self.extended_frame = True
+                    self.sendMSG(['C', 'WVM', 'FRM', [FRAME_VERSION]])
             elif control=='C' and command == 'DCN':
                 if self.nameDuplicate == 0:
                     assert(self.user_name == data[0])
                 else:
                     assert(self.user_name[:-3] == data[0])
+                self.controller.toWorkList([control, command, data, self])
                 self.sig_kill_me.emit(self.user_name)
                 return
             self.controller.toWorkList([control, command, data, self])
@@ -1,5 +1,12 @@
+import ctypes
+
+import numpy as np
+
+from clock import SYSTEM_CLOCK
+
 class DummyWavemeter():
-    def __init__(self):
+    def __init__(self, clock=SYSTEM_CLOCK):
+        self.clock = clock
         self._init_parameters()
 
     def _init_parameters(self):
@@ -7,8 +14,42 @@ class DummyWavemeter():
         self.cCtrlStopAll = -3937
         self.cCtrlStartMeasurement = 3937
         self.switchDelay = 100
+        self.cExposureMin = 1
+        self.cExposureMax = 2000
+
+        self.cInstNotification = 1
+        self.cNotifyInstallWaitEvent = 2
+        self.cNotifyRemoveWaitEvent = 3
+        ### Synthetic event modes announcing a new result of switch channel 0~8
+        self.cmiWavelengthChannel = {1000 + channel: channel for channel in range(9)}
+
+        self.cSignal1Interferometers = 0
+        self.cSignal1WideInterferometer = 1
+        self.l1 = 2048
+        self.l2 = 2048
+        self.is1 = 2
+        self.is2 = 2
+        self.patterns_enabled = False
+
+        self.switch_channel = 0
+        self.switcher_mode = 0
+        self.signal_states = {}
+        self.exposure_time = {}
+        self.event_installed = False
+        self.event_timeout = 0
+        self.event_result = 0
+        self.mode = 0
 
     def Instantiate(self, num1, num2, num3, num4):
+        if num1 == self.cInstNotification:
+            if num2 == self.cNotifyInstallWaitEvent:
+                self.event_installed = True
+                self.event_timeout = num3
+                return 1
+            elif num2 == self.cNotifyRemoveWaitEvent:
+                self.event_installed = False
+                return 1
+
         if num1 != -1 or num2 != 0 or num3 != 0 or num4 != 0:
             print("[Dummy wavemeter] Wrong - Instantiate(-1, 0, 0, 0)")
             return -1
@@ -24,11 +65,20 @@ class DummyWavemeter():
             print("[Dummy Wavemeter] Wrong - Operation(WM.cCtrlxxx)")
 
     def SetSwitcherChannel(self, switch_channel):
-        pass
+        self.switch_channel = switch_channel
+
+    def SetSwitcherMode(self, mode):
+        self.switcher_mode = mode
+
+    def SetSwitcherSignalStates(self, switch_channel, use, show):
+        self.signal_states[switch_channel] = use
 
     def SetExposureNum(self, switch_channel, num, exposure_time):
         if num != 1:
             print("[Dummy Wavemeter] Wrong - SetExposureNum(SWCh, 1, exptime")
+            return
+
+        self.exposure_time[switch_channel] = exposure_time
 
     def GetFrequencyNum(self, switch_channel, num):
         if num != 0:
@@ -36,3 +86,49 @@ class DummyWavemeter():
             return 0
 
         return 751.0101
+
+    def enable_patterns(self, enable=True):
+        self.patterns_enabled = enable
+
+    def GetPatternDataNum(self, switch_channel, index, address):
+        """ Writes synthetic fringes of 2-byte items to the buffer at address. The fringe
+            period depends on the interferometer and the switch channel, and the fringes
+            drift slowly in time.
+        """
+        if index == self.cSignal1Interferometers:
+            num_items = self.l1
+        elif index == self.cSignal1WideInterferometer:
+            num_items = self.l2
+        else:
+            print("[Dummy Wavemeter] Wrong - GetPatternDataNum(SWCh, cSignal1xxx, buffer)")
+            return -1
+
+        pattern = np.ctypeslib.as_array((ctypes.c_uint16 * num_items).from_address(address))
+        period = 40.0 + 8.0 * switch_channel + 150.0 * index
+        phase = 2 * np.pi * (self.clock.time() % 10.0) / 10.0
+        position = np.arange(num_items)
+        envelope = np.exp(-((position - num_items / 2) / (num_items / 3)) ** 2)
+        pattern[:] = 200 + 1800 * envelope * (1 + np.cos(2 * np.pi * position / period + phase))
+        return 1
+
+    def WEvent(self):
+        """ Emulates WaitForWLMEvent. Blocks for the exposure of the active switch channel
+            and announces its new result with the synthetic event mode of the channel.
+        """
+        if not self.event_installed:
+            self.event_result = -1
+            return 0
+
+        exposure_time = self.exposure_time.get(self.switch_channel, 1)
+        if self.event_timeout and exposure_time > self.event_timeout:
+            self.clock.sleep(0.001 * self.event_timeout)
+            self.event_result = 0
+            return 0
+
+        self.clock.sleep(0.001 * exposure_time)
+        self.event_result = 1
+        self.mode = 1000 + self.switch_channel
+        return self.mode
+
+    def EventChannel(self, mode):
+        return self.cmiWavelengthChannel.get(mode, -1)
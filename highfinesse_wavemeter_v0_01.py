@@ -2,6 +2,41 @@ import ctypes
 
 byref = ctypes.byref
 
+WLM_DATA_PATH = r'C:\Windows\System32\wlmData.dll'
+
+### Prototypes of the functions of wlmData : name -> (argtypes, restype)
+WLM_FUNCTIONS = {
+    'Instantiate': ([ctypes.c_long, ctypes.c_long, ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'ControlWLM': ([ctypes.c_long, ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'Operation': ([ctypes.c_ushort], ctypes.c_long),
+    'SetExposure': ([ctypes.c_ushort], ctypes.c_long),
+    'SetExposureNum': ([ctypes.c_long, ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'SetExposure2': ([ctypes.c_ushort], ctypes.c_long),
+    'GetExposure': ([ctypes.c_ushort], ctypes.c_ushort),
+    'GetInterval': ([ctypes.c_long], ctypes.c_long),
+    'WaitForWLMEvent': ([ctypes.POINTER(ctypes.c_long), ctypes.POINTER(ctypes.c_long), \
+        ctypes.POINTER(ctypes.c_double)], ctypes.c_long),
+    'GetWavelengthNum': ([ctypes.c_long, ctypes.c_double], ctypes.c_double),
+    'GetFrequencyNum': ([ctypes.c_long, ctypes.c_double], ctypes.c_double),
+    'SetSwitcherChannel': ([ctypes.c_long], ctypes.c_long),
+    'GetActiveChannel': ([ctypes.c_long, ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'SetSwitcherSignalStates': ([ctypes.c_long, ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'SetSwitcherMode': ([ctypes.c_long], ctypes.c_long),
+    'SetActiveChannel': ([ctypes.c_long, ctypes.c_long, ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'GetPatternItemCount': ([ctypes.c_long], ctypes.c_long),
+    'GetPatternItemSize': ([ctypes.c_long], ctypes.c_long),
+    'SetPattern': ([ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'GetPatternDataNum': ([ctypes.c_long, ctypes.c_long, ctypes.c_void_p], ctypes.c_long),
+    'GetPatternData': ([ctypes.c_long, ctypes.c_void_p], ctypes.c_long),
+    'GetSwitcherChannel': ([ctypes.c_long], ctypes.c_long),
+    'GetAmplitudeNum': ([ctypes.c_long, ctypes.c_long, ctypes.c_long], ctypes.c_long),
+    'GetCalWavelength': ([ctypes.c_long, ctypes.c_double], ctypes.c_double),
+    'Calibration': ([ctypes.c_long, ctypes.c_long, ctypes.c_double, ctypes.c_long], ctypes.c_long)
+}
+
+### Attributes of the patterns set by _init_patterns
+_PATTERN_ATTRIBUTES = ('l1', 'l2', 'is1', 'is2', 'buf1', 'buf2')
+
 class HighfinesseWavemeter:
     # Instantiating Constants for 'RFC' parameter
     cInstCheckForWLM = -1;
@@ -93,7 +128,7 @@ class HighfinesseWavemeter:
     cmiAppearance = 36;
     cmiAutoCalMode = 37;
     cmiWavelength1 = 42;
-##	const int	cmiWavelength2 = 43;
+    cmiWavelength2 = 43;
 ##	const int	cmiLinewidth = 44;
 ##	const int	cmiLinewidthMode = 45;
 ##	const int	cmiLinkDlg = 56;
@@ -101,12 +136,12 @@ class HighfinesseWavemeter:
 ##	const int	cmiAnalogIn = 66;
 ##	const int	cmiAnalogOut = 67;
 ##	const int	cmiDistance = 69;
-##	const int	cmiWavelength3 = 90;
-##	const int	cmiWavelength4 = 91;
-##	const int	cmiWavelength5 = 92;
-##	const int	cmiWavelength6 = 93;
-##	const int	cmiWavelength7 = 94;
-##	const int	cmiWavelength8 = 95;
+    cmiWavelength3 = 90;
+    cmiWavelength4 = 91;
+    cmiWavelength5 = 92;
+    cmiWavelength6 = 93;
+    cmiWavelength7 = 94;
+    cmiWavelength8 = 95;
 ##	const int	cmiVersion0 = cmiVersion;
 ##	const int	cmiVersion1 = 96;
 ##	const int	cmiDLLAttach = 121;
@@ -253,20 +288,18 @@ class HighfinesseWavemeter:
     
     cExposureMax = 2000
     cExposureMin = 1
-    def __init__(self):
-        self.wlmData = ctypes.cdll.LoadLibrary('C:\Windows\System32\wlmData.dll')
-        
-        self.Instantiate = self.wlmData.Instantiate
-        self.Instantiate.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_long, ctypes.c_long]
-        self.Instantiate.restypes = ctypes.c_long
-        
-        self.ControlWLM = self.wlmData.ControlWLM
-        self.ControlWLM.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_long]
-        self.ControlWLM.restype = ctypes.c_long
-        
-        self.Operation=self.wlmData.Operation
-        self.Operation.argtypes=[ctypes.c_ushort]
-        self.Operation.restype = ctypes.c_long
+
+    # Switch channel whose new result is announced by the cmiWavelengthN event
+    cmiWavelengthChannel = {cmiWavelength1: 1, cmiWavelength2: 2, cmiWavelength3: 3,
+        cmiWavelength4: 4, cmiWavelength5: 5, cmiWavelength6: 6, cmiWavelength7: 7,
+        cmiWavelength8: 8}
+
+    def __init__(self, library_path=WLM_DATA_PATH):
+        """ Load the library of the wavemeter. The functions of the library are resolved on
+            their first use, and the pattern export is enabled by enable_patterns() only when
+            a client subscribes to the interferometer patterns.
+        """
+        self.wlmData = ctypes.cdll.LoadLibrary(library_path)
 
 ##          Need to reformat the following
 ##        opState=wlmData.GetOperationState(0)
@@ -277,79 +310,38 @@ class HighfinesseWavemeter:
 ##            print "WS-U is in the middle of adjustment"
 ##            os.exit(1)
 
-        self.SetExposure = self.wlmData.SetExposure
-        self.SetExposure.argtype = ctypes.c_ushort
-        self.SetExposure.restype = ctypes.c_long
-        
-        self.SetExposureNum = self.wlmData.SetExposureNum
-        self.SetExposureNum.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_long]
-        self.SetExposureNum.restype = ctypes.c_long
-        
-        self.SetExposure2 = self.wlmData.SetExposure2
-        self.SetExposure2.argtypes = [ctypes.c_ushort]
-        self.SetExposure2.restype = ctypes.c_long
-
-        self.GetExposure = self.wlmData.GetExposure
-        self.GetExposure.argtypes = [ctypes.c_ushort]
-        self.GetExposure.restype = ctypes.c_ushort
-
-        self.GetInterval = self.wlmData.GetInterval
-        self.GetInterval.argtypes = [ctypes.c_long]
-        self.GetInterval.restype = ctypes.c_long
-
-        self.WaitForWLMEvent=self.wlmData.WaitForWLMEvent
-        self.WaitForWLMEvent.argtypes=[ctypes.POINTER(ctypes.c_long), ctypes.POINTER(ctypes.c_long), ctypes.POINTER(ctypes.c_double)]
-        self.WaitForWLMEvent.restype=ctypes.c_long
         self.mode=ctypes.c_long()
         self.i=ctypes.c_long()
         self.d=ctypes.c_double()
-        
-        self.GetWavelengthNum = self.wlmData.GetWavelengthNum
-        self.GetWavelengthNum.argtypes = [ctypes.c_long, ctypes.c_double]
-        self.GetWavelengthNum.restype = ctypes.c_double
-
-        self.GetFrequencyNum = self.wlmData.GetFrequencyNum
-        self.GetFrequencyNum.argtypes = [ctypes.c_long, ctypes.c_double]
-        self.GetFrequencyNum.restype = ctypes.c_double
+        self.event_result = 0
+        self.patterns_enabled = False
 
+        self.switchDelay = 100
 
-        self.SetSwitcherChannel = self.wlmData.SetSwitcherChannel
-        self.SetSwitcherChannel.argtypes = [ctypes.c_long]
-        self.SetSwitcherChannel.restype = ctypes.c_long
-
-        self.GetActiveChannel = self.wlmData.GetActiveChannel
-        self.GetActiveChannel.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_long]
-        self.GetActiveChannel.restype = ctypes.c_long
-
-        self.SetSwitcherSignalStates = self.wlmData.SetSwitcherSignalStates
-        self.SetSwitcherSignalStates.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_long]
-        self.SetSwitcherSignalStates.restype = ctypes.c_long
-
-        self.SetSwitcherMode = self.wlmData.SetSwitcherMode
-        self.SetSwitcherMode.argtypes = [ctypes.c_long]
-        self.SetSwitcherMode.restype = ctypes.c_long
-
-        self.SetActiveChannel = self.wlmData.SetActiveChannel
-        self.SetActiveChannel.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_long, ctypes.c_long]
-        self.SetActiveChannel.restype = ctypes.c_long
-
-        self.GetPatternItemCount=self.wlmData.GetPatternItemCount
-        self.GetPatternItemCount.argtypes=[ctypes.c_long]
-        self.GetPatternItemCount.restype=ctypes.c_long
-        
-        self.l1=self.GetPatternItemCount(wavemeter.cSignal1Interferometers)
-        self.l2=self.GetPatternItemCount(wavemeter.cSignal1WideInterferometer)
+    def __getattr__(self, name):
+        """ Resolve the function of the library on its first use and keep it as the
+            attribute, so later calls do not come here again.
+        """
+        if name in WLM_FUNCTIONS and 'wlmData' in self.__dict__:
+            function = getattr(self.wlmData, name)
+            function.argtypes, function.restype = WLM_FUNCTIONS[name]
+            setattr(self, name, function)
+            return function
+        elif name in _PATTERN_ATTRIBUTES and 'wlmData' in self.__dict__:
+            self._init_patterns()
+            return self.__dict__[name]
+        raise AttributeError("%s has no attribute %s" % (type(self).__name__, name))
+
+    def _init_patterns(self):
+        """ Query the size of the patterns and allocate their buffers """
+        self.l1=self.GetPatternItemCount(self.cSignal1Interferometers)
+        self.l2=self.GetPatternItemCount(self.cSignal1WideInterferometer)
 
         if self.l1 != 2048 or self.l2 != 2048:
             print ('Error: Pattern Item Count %d, %d. We expect 2048 for both numbers.', self.l1, self.l2)
 
-
-        self.GetPatternItemSize=self.wlmData.GetPatternItemSize
-        self.GetPatternItemSize.argtypes=[ctypes.c_long]
-        self.GetPatternItemSize.restype=ctypes.c_long
-                    
-        self.is1=self.GetPatternItemSize(wavemeter.cSignal1Interferometers)
-        self.is2=self.GetPatternItemSize(wavemeter.cSignal1WideInterferometer)
+        self.is1=self.GetPatternItemSize(self.cSignal1Interferometers)
+        self.is2=self.GetPatternItemSize(self.cSignal1WideInterferometer)
 
         if self.is1 != 2 or self.is2 != 2:
             print ('Error: Pattern Item Size %d, %d. We expect 2 for both numbers.', self.is1, self.is2)
@@ -357,57 +349,38 @@ class HighfinesseWavemeter:
         self.buf1=ctypes.create_string_buffer(self.l1 * self.is1)
         self.buf2=ctypes.create_string_buffer(self.l2 * self.is2)
 
-        self.SetPattern=self.wlmData.SetPattern
-        self.SetPattern.argtypes=[ctypes.c_long, ctypes.c_long]
-        self.SetPattern.restype=ctypes.c_long
-
-        self.GetPatternDataNum=self.wlmData.GetPatternDataNum
-        self.GetPatternDataNum.argtypes=[ctypes.c_long, ctypes.c_long, ctypes.c_void_p]
-        self.GetPatternDataNum.restype=ctypes.c_long
-
-        self.GetPatternData=self.wlmData.GetPatternData
-        self.GetPatternData.argtypes=[ctypes.c_long, ctypes.c_void_p]
-        self.GetPatternData.restype=ctypes.c_long
+    def enable_patterns(self, enable=True):
+        """ Let the wavemeter export the patterns of both interferometers, or stop it """
+        if enable == self.patterns_enabled:
+            return
+        state = self.cPatternEnable if enable else self.cPatternDisable
+        self.SetPattern(self.cSignal1Interferometers, state)
+        self.SetPattern(self.cSignal1WideInterferometer, state)
+        self.patterns_enabled = enable
 
-        self.SetPattern(wavemeter.cSignal1Interferometers, wavemeter.cPatternEnable)
-        self.SetPattern(wavemeter.cSignal1WideInterferometer, wavemeter.cPatternEnable)
-
-        self.GetSwitcherChannel = self.wlmData.GetSwitcherChannel
-        self.GetSwitcherChannel.argtypes = [ctypes.c_long]
-        self.GetSwitcherChannel.restype = ctypes.c_long
-        
-        self.GetAmplitudeNum = self.wlmData.GetAmplitudeNum
-        self.GetAmplitudeNum.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_long]
-        self.GetAmplitudeNum.restype = ctypes.c_long
-        
-        self.GetCalWavelength = self.wlmData.GetCalWavelength
-        self.GetCalWavelength.argtypes = [ctypes.c_long, ctypes.c_double]
-        self.GetCalWavelength.restype = ctypes.c_double
-        
-        self.Calibration = self.wlmData.Calibration
-        self.Calibration.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_double, ctypes.c_long]
-        self.Calibration.restype = ctypes.c_long
-        
-        
-        self.switchDelay = 100
-    
     def updatePatternNum1(self, num):
-        self.GetPatternData(wavemeter.cSignal1Interferometers, self.buf1)
+        self.GetPatternDataNum(num, self.cSignal1Interferometers, self.buf1)
 
     def updatePatternNum2(self, num):
-        self.GetPatternData(wavemeter.cSignal1WideInterferometer, self.buf2)
+        self.GetPatternDataNum(num, self.cSignal1WideInterferometer, self.buf2)
     
     def updatePattern1(self):
-        self.GetPatternData(wavemeter.cSignal1Interferometers, self.buf1)
+        self.GetPatternData(self.cSignal1Interferometers, self.buf1)
 
     def updatePattern2(self):
-        self.GetPatternData(wavemeter.cSignal1WideInterferometer, self.buf2)
+        self.GetPatternData(self.cSignal1WideInterferometer, self.buf2)
 
     def WEvent(self):
 #        print 'I am  here'
-        WEventResult = self.WaitForWLMEvent(byref(self.mode), byref(self.i), byref(self.d))
-#        print WEventResult
+        self.event_result = self.WaitForWLMEvent(byref(self.mode), byref(self.i), byref(self.d))
+#        print self.event_result
         return self.mode.value
+
+    def EventChannel(self, mode):
+        """ Returns the switch channel of which the measurement result is announced by
+            the event mode, or -1 if the event is not a measurement result.
+        """
+        return self.cmiWavelengthChannel.get(mode, -1)
         
 ########################################################################################################
 # If I need to switch between port 1 and calibration port...
@@ -0,0 +1,183 @@
+""" Append-only binary log of the measurements of PIDLoop.
+
+    Every measurement is written as a fixed-size record of LOG_RECORD after a
+    short file header. PIDLoop only hands the records of a cycle over to the
+    MeasurementLogWriter thread, so disk latency never stretches the control
+    loop. The log file is rotated when it exceeds max_bytes or the day changes.
+
+    MeasurementLogReader maps a log file into memory and returns the records as
+    NumPy structured arrays, per channel if needed.
+
+    Channel names are stored in utf-8 in LOG_CHANNEL_SIZE bytes. The controller
+    refuses the channels whose names do not fit when it loads the configuration.
+"""
+
+import os
+import time
+import struct
+from collections import deque
+
+import numpy as np
+from PyQt5.QtCore import QThread, QMutex, QWaitCondition
+
+LOG_MAGIC = b'WVMLOG'
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct('<6sHI')     # magic, version, record size
+LOG_CHANNEL_SIZE = 16                   # bytes of the channel name in utf-8
+LOG_RECORD = np.dtype([
+    ('time', '<f8'),
+    ('channel', 'S%d' % LOG_CHANNEL_SIZE),
+    ('frequency', '<f8'),
+    ('output_voltage', '<f8'),
+    ('exposure_time', '<i4'),
+    ('accumulator', '<f8'),
+    ('proportional', '<f8'),
+    ('differentiator', '<f8'),
+    ('pid_on', 'u1')
+])
+LOG_EXTENSION = '.wlog'
+
+def encode_channel_name(channel_name):
+    """ Return the channel name as stored in the log. Raise ValueError if it is longer
+        than LOG_CHANNEL_SIZE bytes in utf-8, as it would be cut silently.
+    """
+    encoded = channel_name.encode('utf-8')
+    if len(encoded) > LOG_CHANNEL_SIZE:
+        raise ValueError("Channel name longer than %d bytes in utf-8 - %s" % (LOG_CHANNEL_SIZE, channel_name))
+    return encoded
+
+class MeasurementLogWriter(QThread):
+    def __init__(self, directory, max_bytes=64 << 20, max_pending=100000):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+
+        self._pending = deque()
+        self._mutex = QMutex()
+        self._cond = QWaitCondition()
+        self._stopping = False
+        self._file = None
+        self._file_day = None
+        self._file_bytes = 0
+
+        self.records_written = 0
+        self.records_dropped = 0
+
+    def write_records(self, records):
+        """ Queue the records of a cycle, each of which is a tuple of the fields of
+            LOG_RECORD. Called from PIDLoop, so it never touches the disk.
+        """
+        self._mutex.lock()
+        if len(self._pending) + len(records) > self.max_pending:
+            ### The disk does not keep up. Drop the newest records rather than blocking.
+            self.records_dropped += len(records)
+        else:
+            self._pending.extend(records)
+            self._cond.wakeOne()
+        self._mutex.unlock()
+
+        if not self.isRunning():
+            self.start()
+
+    def _open_file(self, now):
+        if self._file is not None:
+            self._file.close()
+
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = time.strftime('wavemeter_%Y%m%d_%H%M%S', time.localtime(now)) + LOG_EXTENSION
+        file_path = os.path.join(self.directory, file_name)
+        index = 1
+        while os.path.exists(file_path):
+            file_path = os.path.join(self.directory, file_name[:-len(LOG_EXTENSION)] + \
+                '_' + str(index) + LOG_EXTENSION)
+            index += 1
+
+        self._file = open(file_path, 'wb')
+        self._file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, LOG_RECORD.itemsize))
+        self._file_day = time.localtime(now)[:3]
+        self._file_bytes = LOG_HEADER.size
+
+    def _write(self, records):
+        now = time.time()
+        if self._file is None or self._file_bytes >= self.max_bytes \
+            or time.localtime(now)[:3] != self._file_day:
+            self._open_file(now)
+
+        ### NumPy would encode the channel names in ASCII
+        block = np.array([(record[0], encode_channel_name(record[1])) + tuple(record[2:]) \
+            for record in records], dtype=LOG_RECORD).tobytes()
+        self._file.write(block)
+        self._file.flush()
+        self._file_bytes += len(block)
+        self.records_written += len(records)
+
+    def stop(self):
+        """ Write the pending records, close the log file and end the thread. """
+        self._mutex.lock()
+        self._stopping = True
+        self._cond.wakeOne()
+        self._mutex.unlock()
+        self.wait()
+
+    def run(self):
+        while True:
+            self._mutex.lock()
+            while not self._pending and not self._stopping:
+                self._cond.wait(self._mutex)
+            records = list(self._pending)
+            self._pending.clear()
+            stopping = self._stopping
+            self._mutex.unlock()
+
+            if records:
+                try:
+                    self._write(records)
+                except (OSError, ValueError, TypeError) as err:
+                    ### Records that cannot be converted are dropped as well, so the thread never dies
+                    # todo - exception
+                    print("[Measurement log] Fail to write the log - ", err)
+                    self.records_dropped += len(records)
+            if stopping:
+                break
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class MeasurementLogReader():
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as log_file:
+            magic, version, record_size = LOG_HEADER.unpack(log_file.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC or version != LOG_VERSION or record_size != LOG_RECORD.itemsize:
+            raise ValueError("Not a measurement log of version %d : %s" % (LOG_VERSION, file_path))
+
+        ### A record being written at the moment is not mapped
+        num_records = (os.path.getsize(file_path) - LOG_HEADER.size) // LOG_RECORD.itemsize
+        if num_records > 0:
+            self.records = np.memmap(file_path, dtype=LOG_RECORD, mode='r', \
+                offset=LOG_HEADER.size, shape=(num_records,))
+        else:
+            self.records = np.zeros(0, dtype=LOG_RECORD)
+
+    def __len__(self):
+        return len(self.records)
+
+    def channel_names(self):
+        return [name.decode('utf-8') for name in np.unique(self.records['channel'])]
+
+    def channel(self, channel_name):
+        """ Return the records of the channel in the order of time. """
+        return self.records[self.records['channel'] == channel_name.encode('utf-8')]
+
+    def channels(self):
+        """ Yield (channel name, records of the channel) for every channel in the log. """
+        for channel_name in self.channel_names():
+            yield channel_name, self.channel(channel_name)
+
+def log_files(directory):
+    """ Return the log files in the directory in the order of creation. """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, file_name) for file_name in os.listdir(directory) \
+        if file_name.endswith(LOG_EXTENSION))
@@ -0,0 +1,176 @@
+""" Framing of the messages sent to the clients.
+
+    A frame is [ 16-bit length | control | 'WVM' | command | data ] in QDataStream
+    (Qt_5_0). Frames of FRAME_EXTENDED bytes or more are prefixed with
+    FRAME_EXTENDED followed by the 32-bit length instead. Clients understanding the
+    extended frame request it with 'L32' in the options of CON, and the server
+    acknowledges it with FRM.
+
+    EncodedMessage is a message which keeps its frame once encoded, so a message
+    sent to many clients, or to many clients over time, is encoded only once.
+
+    OutboundQueue keeps the frames waiting to be written to the socket of a client.
+    It is shared by the client handlers of the Qt server and of the asyncio server.
+"""
+
+from collections import deque
+
+from PyQt5.QtCore import QByteArray, QDataStream, QIODevice, QMutex
+
+FRAME_EXTENDED = 0xFFFF
+FRAME_VERSION = 2
+
+def encode_message(msg, extended_frame=False):
+    """ Return the frame of the message as QByteArray, or None if the message is too large
+        for the 16-bit frame and extended_frame is False.
+    """
+    block = QByteArray()
+    output = QDataStream(block, QIODevice.WriteOnly)
+    output.setVersion(QDataStream.Qt_5_0)
+
+    output.writeUInt16(0)
+    output.writeQString(msg[0])     ### flag C/S
+    output.writeQString(msg[1])
+    output.writeQString(msg[2])     ### command of 3 or 4 characters
+    output.writeQVariantList(msg[3]) ### data
+    output.device().seek(0)
+    block_size = block.size()-2
+    if block_size < FRAME_EXTENDED:
+        output.writeUInt16(block_size)
+        return block
+    elif not extended_frame:
+        print("[Message frame] Message too large for the 16-bit frame - ", msg[2], block_size)
+        return None
+
+    ### Extended frame : FRAME_EXTENDED | 32-bit length | message
+    header = QByteArray()
+    header_stream = QDataStream(header, QIODevice.WriteOnly)
+    header_stream.setVersion(QDataStream.Qt_5_0)
+    header_stream.writeUInt16(FRAME_EXTENDED)
+    header_stream.writeUInt32(block_size)
+    return header + block.mid(2)
+
+class EncodedMessage(list):
+    """ Message [control, 'WVM', command, data] encoding its frame at most once. It is a
+        list, so the clients which do not use the frame handle it as any other message.
+        The message must not be modified after it is created.
+    """
+    def __init__(self, message):
+        super().__init__(message)
+        self._frame = None
+        self._extended = False
+
+    def frame(self, extended_frame=False):
+        """ Return the shared frame, or None if the message needs the extended frame which
+            the client does not understand.
+        """
+        if self._frame is None:
+            frame = encode_message(self, True)
+            self._extended = frame.size() - 2 >= FRAME_EXTENDED
+            self._frame = frame
+
+        if self._extended and not extended_frame:
+            print("[Message frame] Message too large for the 16-bit frame - ", self[2], self._frame.size())
+            return None
+        return self._frame
+
+class OutboundQueue():
+    """ Frames waiting to be written to the socket of a client. Messages are encoded by
+        the thread putting them, unless they are EncodedMessage carrying their frame
+        already, and the client handler takes all of them at once for a single write.
+        Thread-safe.
+
+        Pending measurement messages (replaceable_commands) are replaced by the newer
+        sample of the same channel, and new ones are dropped while the queued bytes
+        exceed high_water_mark, so a slow client only receives the latest samples.
+    """
+    replaceable_commands = ('CFR', 'VLT', 'APD', 'CFB', 'ITF')
+
+    def __init__(self, high_water_mark, convert=None):
+        """ convert turns the QByteArray frame into the type written to the socket. """
+        self.high_water_mark = high_water_mark
+        self._convert = convert
+        ### slot : [key, frame]
+        self._queue = deque()
+        self._pending = {}
+        self._bytes = 0
+        self._mutex = QMutex()
+        self._flush_scheduled = False
+
+        self.messages_replaced = 0
+        self.messages_dropped = 0
+
+    def _replace_key(self, msg):
+        """ Key of the measurement message that can be superseded by a newer one. """
+        if msg[2] not in self.replaceable_commands:
+            return None
+        elif msg[2] == 'CFB' or not msg[3]:
+            return (msg[2],)
+        return (msg[2], msg[3][0])
+
+    def put(self, msg, extended_frame=False):
+        """ Encode the message and queue its frame. Return True if the caller should
+            schedule a flush, i.e. no flush is pending since the last take.
+        """
+        if isinstance(msg, EncodedMessage):
+            frame = msg.frame(extended_frame)
+        else:
+            frame = encode_message(msg, extended_frame)
+        if frame is None:
+            return False
+        if self._convert is not None:
+            frame = self._convert(frame)
+        key = self._replace_key(msg)
+
+        self._mutex.lock()
+        try:
+            if key is not None and key in self._pending:
+                ### The client has not received the previous sample yet. Send the latest one only.
+                slot = self._pending[key]
+                self._bytes += len(frame) - len(slot[1])
+                slot[1] = frame
+                self.messages_replaced += 1
+                return False
+            elif key is not None and self._bytes >= self.high_water_mark:
+                ### Slow consumer - measurements are dropped until the queue drains
+                self.messages_dropped += 1
+                return False
+
+            slot = [key, frame]
+            if key is not None:
+                self._pending[key] = slot
+            self._queue.append(slot)
+            self._bytes += len(frame)
+
+            if self._flush_scheduled:
+                return False
+            self._flush_scheduled = True
+            return True
+        finally:
+            self._mutex.unlock()
+
+    def take(self):
+        """ Return the list of all queued frames in order, and empty the queue. """
+        self._mutex.lock()
+        try:
+            self._flush_scheduled = False
+            frames = [slot[1] for slot in self._queue]
+            self._queue.clear()
+            self._pending.clear()
+            self._bytes = 0
+            return frames
+        finally:
+            self._mutex.unlock()
+
+    def statistics(self):
+        """ Return the metrics of the queue. """
+        self._mutex.lock()
+        try:
+            return {
+                'queue depth': len(self._queue),
+                'queued bytes': self._bytes,
+                'messages replaced': self.messages_replaced,
+                'messages dropped': self.messages_dropped
+            }
+        finally:
+            self._mutex.unlock()
@@ -0,0 +1,148 @@
+""" PID controller core shared by PIDLoop and the offline tools.
+
+    PIDCore holds the limits common to the channels, and steps the state of the
+    channels, which is either
+    1. PIDState : The state of a channel with __slots__, stepped by step().
+    2. PIDArrays : The states of many channels (or of many parameter sets of a
+      channel) in NumPy arrays, stepped at once by step_many().
+    Both give the same result for the same inputs.
+
+    A step filters the measured frequency into the weighted frequency, which is
+    reset when it jumps more than 1 GHz, and computes the output voltage
+        bias + (accumulator + proportional + differentiator) * gain
+    from the frequency offset and change clamped to max_frequency_offset and
+    max_frequency_change. The output is clamped to [output_min, output_max], and
+    with anti_windup the accumulator does not integrate while the output is
+    clamped.
+"""
+
+import math
+
+import numpy as np
+
+### Change of the measured frequency (THz) resetting the weighted frequency
+WEIGHT_RESET = 0.001
+WEIGHT = 0.9
+
+class PIDState():
+    __slots__ = ('pp', 'ii', 'dd', 'gain', 'target_frequency', 'weighted_frequency', \
+        'accumulator', 'proportional', 'differentiator')
+
+    def __init__(self, pp=0, ii=0, dd=0, gain=0, target_frequency=0.0):
+        self.pp = pp
+        self.ii = ii
+        self.dd = dd
+        self.gain = gain
+        self.target_frequency = target_frequency
+        self.weighted_frequency = 0.0
+        self.accumulator = 0.0
+        self.proportional = 0.0
+        self.differentiator = 0.0
+
+class PIDArrays():
+    __slots__ = ('pp', 'ii', 'dd', 'gain', 'target_frequency', 'weighted_frequency', \
+        'accumulator', 'proportional', 'differentiator')
+
+    def __init__(self, pp, ii, dd, gain, target_frequency):
+        """ Each argument is an array with an element per channel, or a number shared by all. """
+        self.pp, self.ii, self.dd, self.gain, self.target_frequency = (np.array(values) for values \
+            in np.broadcast_arrays(*(np.atleast_1d(np.asarray(values, dtype=np.float64)) \
+            for values in (pp, ii, dd, gain, target_frequency))))
+        self.weighted_frequency = np.zeros(self.pp.shape)
+        self.accumulator = np.zeros(self.pp.shape)
+        self.proportional = np.zeros(self.pp.shape)
+        self.differentiator = np.zeros(self.pp.shape)
+
+    def __len__(self):
+        return len(self.pp)
+
+class PIDCore():
+    __slots__ = ('max_frequency_offset', 'max_frequency_change', 'output_min', 'output_max', 'anti_windup')
+
+    def __init__(self, max_frequency_offset, max_frequency_change, output_min=-math.inf, \
+        output_max=math.inf, anti_windup=True):
+        self.max_frequency_offset = max_frequency_offset
+        self.max_frequency_change = max_frequency_change
+        self.output_min = output_min
+        self.output_max = output_max
+        self.anti_windup = anti_windup
+
+    def step(self, state, frequency, delta_t, bias=0.0, pid_on=True):
+        """ Step the channel with the measured frequency and the time since its previous
+            measurement. Return the new output voltage, or None if the PID is off.
+        """
+        previous_weighted_frequency = state.weighted_frequency
+        if abs(frequency - previous_weighted_frequency) > WEIGHT_RESET:
+            state.weighted_frequency = frequency
+        else:
+            state.weighted_frequency = frequency * WEIGHT + previous_weighted_frequency * (1 - WEIGHT)
+
+        if not pid_on:
+            return None
+
+        frequency_offset = state.weighted_frequency - state.target_frequency
+        if frequency_offset > self.max_frequency_offset:
+            frequency_offset = self.max_frequency_offset
+        elif frequency_offset < -self.max_frequency_offset:
+            frequency_offset = -self.max_frequency_offset
+
+        delta_f = state.weighted_frequency - previous_weighted_frequency
+        if delta_f > self.max_frequency_change:
+            delta_f = self.max_frequency_change
+        elif delta_f < -self.max_frequency_change:
+            delta_f = -self.max_frequency_change
+
+        accumulator = state.accumulator + state.ii * frequency_offset * delta_t
+        state.proportional = state.pp * frequency_offset
+        state.differentiator = state.dd * delta_f / delta_t if delta_t > 0 else 0.0
+        output = bias + (accumulator + state.proportional + state.differentiator) * state.gain
+
+        if output > self.output_max:
+            output = self.output_max
+        elif output < self.output_min:
+            output = self.output_min
+        else:
+            state.accumulator = accumulator
+            return output
+
+        if not self.anti_windup:
+            state.accumulator = accumulator
+        return output
+
+    def step_many(self, arrays, frequencies, delta_t, bias=0.0, pid_on=True):
+        """ Step every channel of the PIDArrays at once. frequencies, delta_t, bias and pid_on
+            are arrays with an element per channel or numbers shared by all. Return the array
+            of the new output voltages, which is NaN where the PID is off.
+        """
+        frequencies = np.asarray(frequencies, dtype=np.float64)
+        previous_weighted_frequency = arrays.weighted_frequency
+        arrays.weighted_frequency = np.where( \
+            np.abs(frequencies - previous_weighted_frequency) > WEIGHT_RESET, frequencies, \
+            frequencies * WEIGHT + previous_weighted_frequency * (1 - WEIGHT))
+
+        frequency_offset = np.clip(arrays.weighted_frequency - arrays.target_frequency, \
+            -self.max_frequency_offset, self.max_frequency_offset)
+        delta_f = np.clip(arrays.weighted_frequency - previous_weighted_frequency, \
+            -self.max_frequency_change, self.max_frequency_change)
+        delta_t = np.asarray(delta_t, dtype=np.float64)
+
+        accumulator = arrays.accumulator + arrays.ii * frequency_offset * delta_t
+        proportional = arrays.pp * frequency_offset
+        with np.errstate(divide='ignore', invalid='ignore'):
+            differentiator = np.where(delta_t > 0, arrays.dd * delta_f / delta_t, 0.0)
+        output = bias + (accumulator + proportional + differentiator) * arrays.gain
+        clamped = np.clip(output, self.output_min, self.output_max)
+        if self.anti_windup:
+            accumulator = np.where(clamped == output, accumulator, arrays.accumulator)
+
+        if pid_on is True:
+            arrays.accumulator = accumulator
+            arrays.proportional = proportional
+            arrays.differentiator = differentiator
+            return clamped
+
+        pid_on = np.asarray(pid_on, dtype=bool)
+        arrays.accumulator = np.where(pid_on, accumulator, arrays.accumulator)
+        arrays.proportional = np.where(pid_on, proportional, arrays.proportional)
+        arrays.differentiator = np.where(pid_on, differentiator, arrays.differentiator)
+        return np.where(pid_on, clamped, np.nan)
@@ -0,0 +1,203 @@
+""" Offline sweep of the PID parameters of a channel.
+
+    Thousands of (pp, ii, dd, gain) combinations are run at once over the same
+    drift trace. The combinations are the channels of PIDArrays, and each step
+    applies PIDCore.step_many, the update of PIDLoop, to all of them together.
+    The output voltage moves the laser through the piezo with the first order
+    lag of SimulatedWavemeter.
+
+    The drift is either recorded (a measurement log or a CSV file, replayed as
+    in ReplayWavemeter with the recorded output voltage taken out) or simulated
+    by the seeded laser of SimulatedWavemeter. Every combination sees the same
+    drift and the same measurement noise.
+
+    The combinations are ranked by the sum of their ranks in RMS error, settling
+    time and actuator effort, and the winner can be written into the
+    configuration file in the format of _capture_current_configuration.
+
+    Usage : python pid_sweep.py --config config/host.ini --channel 369A --simulate 3600
+"""
+
+import sys
+import argparse
+from configparser import ConfigParser
+
+import numpy as np
+
+from simulated_wavemeter import SimulatedLaser
+from replay_wavemeter import load_traces
+from pid_core import PIDCore, PIDArrays
+
+PID_PARAMETERS = ('pp', 'ii', 'dd', 'gain')
+
+def parameter_grid(pp, ii, dd, gain):
+    """ Return the arrays of (pp, ii, dd, gain) of every combination of the given values. """
+    grid = np.meshgrid(np.asarray(pp), np.asarray(ii), np.asarray(dd), np.asarray(gain), indexing='ij')
+    return tuple(values.ravel() for values in grid)
+
+def drift_from_trace(file_path, switch_channel, period, channel_map=None, voltage_response=0.0):
+    """ Resample the recorded trace of the switch channel every period seconds. The effect
+        of the recorded output voltage is taken out with voltage_response, leaving the drift
+        of the free running laser.
+    """
+    traces = load_traces(file_path, channel_map)
+    if switch_channel not in traces:
+        raise ValueError("No trace of switch channel %d in %s" % (switch_channel, file_path))
+
+    times, frequencies, output_voltages = traces[switch_channel]
+    sample_times = np.arange(times[0], times[-1], period)
+    return np.interp(sample_times, times, frequencies - voltage_response * output_voltages)
+
+def simulated_drift(frequency, duration, period, seed=0, switch_channel=0, **laser_options):
+    """ Sample the free running laser of SimulatedWavemeter every period seconds. """
+    rng = np.random.default_rng([seed, switch_channel])
+    options = {'initial_offset': 20e-6, 'drift_rate': 1e-6, 'drift_step': 0.01}
+    options.update(laser_options)
+    laser = SimulatedLaser(frequency + options['initial_offset'] * rng.standard_normal(), rng, \
+        options['drift_rate'], options['drift_step'], 0.0, 0.0, 0.0, 0.0, 0.0)
+
+    drift = np.empty(int(duration / period))
+    for index in range(len(drift)):
+        drift[index] = laser.measure((index + 1) * period)
+    return drift
+
+def sweep(drift, target_frequency, pp, ii, dd, gain, period=1.0, piezo_response=0.02, \
+    piezo_time_constant=0.05, noise=0.1e-6, max_frequency_offset=100e-6, max_frequency_change=30e-6, \
+    settle_threshold=1e-6, settle_count=5, seed=0, output_min=-np.inf, output_max=np.inf):
+    """ Run the PID loop of every combination over the drift sampled every period seconds.
+
+        Return the dictionary of arrays of
+            rms error : RMS of (measured - target) frequency
+            settling time : time until the error stays within settle_threshold for
+              settle_count measurements in a row, inf if it never settles
+            actuator effort : RMS of the change of the output voltage per step
+    """
+    core = PIDCore(max_frequency_offset, max_frequency_change, output_min, output_max)
+    states = PIDArrays(pp, ii, dd, gain, target_frequency)
+    num_sets = len(states)
+    noise_samples = noise * np.random.default_rng(seed).standard_normal(len(drift))
+    lag = 1 - np.exp(-period / piezo_time_constant) if piezo_time_constant > 0 else 1.0
+
+    output = np.zeros(num_sets)
+    piezo_offset = np.zeros(num_sets)
+
+    square_error = np.zeros(num_sets)
+    square_effort = np.zeros(num_sets)
+    in_threshold = np.zeros(num_sets, dtype=np.int64)
+    settling_time = np.full(num_sets, np.inf)
+
+    with np.errstate(all='ignore'):
+        for step in range(len(drift)):
+            measured = drift[step] + noise_samples[step] + piezo_offset
+            new_output = core.step_many(states, measured, period)
+            square_effort += (new_output - output) ** 2
+            output = new_output
+            piezo_offset += (piezo_response * output - piezo_offset) * lag
+
+            error = measured - target_frequency
+            square_error += error ** 2
+            in_threshold = np.where(np.abs(error) < settle_threshold, in_threshold + 1, 0)
+            settling_time[(in_threshold == settle_count) & np.isinf(settling_time)] = (step + 1) * period
+
+    rms_error = np.sqrt(square_error / len(drift))
+    actuator_effort = np.sqrt(square_effort / len(drift))
+    return {
+        'rms error': np.where(np.isfinite(rms_error), rms_error, np.inf),
+        'settling time': settling_time,
+        'actuator effort': np.where(np.isfinite(actuator_effort), actuator_effort, np.inf)
+    }
+
+def rank(metrics):
+    """ Return the indices of the combinations from the best, ordered by the sum of their
+        ranks in each metric. Ties of the sum are broken by the RMS error.
+    """
+    total_rank = np.zeros(len(metrics['rms error']), dtype=np.int64)
+    for values in metrics.values():
+        total_rank += np.argsort(np.argsort(values, kind='stable'), kind='stable')
+    return np.lexsort((metrics['rms error'], total_rank))
+
+def write_parameters(config_path, channel_name, pp, ii, dd, gain, output_path=None):
+    """ Write the PID parameters of the channel into the configuration file, or into
+        output_path keeping the rest of the configuration.
+    """
+    parser = ConfigParser()
+    parser.read(config_path)
+    for section in parser.sections():
+        if section.startswith('CH') and parser[section].get('name') == channel_name:
+            break
+    else:
+        raise ValueError("No channel %s in %s" % (channel_name, config_path))
+
+    for key, value in zip(PID_PARAMETERS, (pp, ii, dd, gain)):
+        parser[section][key] = str(int(value))
+    with open(output_path or config_path, 'w+') as config_file:
+        parser.write(config_file)
+
+def _value_range(text):
+    """ 'start:stop[:step]' (stop inclusive) or comma separated integers """
+    if ':' in text:
+        bounds = [int(value) for value in text.split(':')]
+        step = bounds[2] if len(bounds) > 2 else 1
+        return np.arange(bounds[0], bounds[1] + (1 if step > 0 else -1), step)
+    return np.array([int(value) for value in text.split(',')])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline sweep of the PID parameters of a channel")
+    parser.add_argument('--config', required=True, help="configuration file of the channel")
+    parser.add_argument('--channel', required=True, help="name of the channel")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--trace', help="measurement log, directory of them or CSV file")
+    source.add_argument('--simulate', type=float, help="duration in s of the simulated drift")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--period', type=float, default=1.0, help="s between measurements")
+    parser.add_argument('--voltage-response', type=float, default=0.02, help="THz per unit voltage")
+    parser.add_argument('--pp', type=_value_range, default='0:20')
+    parser.add_argument('--ii', type=_value_range, default='0:40:2')
+    parser.add_argument('--dd', type=_value_range, default='0:4')
+    parser.add_argument('--gain', type=_value_range, default='-4:-1')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--write', nargs='?', const='', default=None, \
+        help="write the winner into the configuration, or into the given file")
+    args = parser.parse_args(argv)
+
+    config = ConfigParser()
+    config.read(args.config)
+    channels = {config[section]['name']: config[section] for section in config.sections() \
+        if section.startswith('CH')}
+    if args.channel not in channels:
+        print("[PID sweep] No channel %s in %s" % (args.channel, args.config))
+        return 1
+    channel = channels[args.channel]
+    target_frequency = float(channel['target frequency'])
+    max_frequency_offset = config.getfloat('PID', 'max freq offset', fallback=100e-6)
+    max_frequency_change = config.getfloat('PID', 'max freq change', fallback=30e-6)
+
+    if args.trace:
+        channel_map = {name: int(section['fiber switch']) for name, section in channels.items()}
+        drift = drift_from_trace(args.trace, int(channel['fiber switch']), args.period, channel_map, \
+            args.voltage_response)
+    else:
+        drift = simulated_drift(target_frequency, args.simulate, args.period, args.seed, \
+            int(channel['fiber switch']))
+
+    pp, ii, dd, gain = parameter_grid(args.pp, args.ii, args.dd, args.gain)
+    print("[PID sweep] %d combinations over %d measurements" % (len(pp), len(drift)))
+    metrics = sweep(drift, target_frequency, pp, ii, dd, gain, args.period, args.voltage_response, \
+        max_frequency_offset=max_frequency_offset, max_frequency_change=max_frequency_change, seed=args.seed)
+
+    order = rank(metrics)
+    print("    pp   ii   dd gain   RMS error(MHz)  settling(s)  effort")
+    for index in order[:args.top]:
+        print("  %4d %4d %4d %4d   %14.3f  %11.1f  %.3g" % (pp[index], ii[index], dd[index], gain[index], \
+            metrics['rms error'][index] * 1e6, metrics['settling time'][index], \
+            metrics['actuator effort'][index]))
+
+    if args.write is not None:
+        best = order[0]
+        write_parameters(args.config, args.channel, pp[best], ii[best], dd[best], gain[best], \
+            args.write or None)
+        print("[PID sweep] Wrote the parameters of %s into %s" % (args.channel, args.write or args.config))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+""" Wavemeter backend replaying recorded frequency traces.
+
+    The traces are read from a measurement log (a .wlog file or a directory of
+    them) or from a CSV file with the columns
+        time, channel, frequency[, output voltage]
+    where channel is either the channel name or the fiber switch channel.
+    Channel names are mapped to fiber switch channels with channel_map.
+
+    The traces of all channels share one time line, which starts when the
+    measurement starts and runs speed times faster than the clock. The
+    frequency of a switch channel is linearly interpolated at the replay time.
+    With voltage_response (frequency change per volt) set, the difference
+    between the output voltage applied by the PID loop and the recorded one is
+    added to the frequency, so the recorded drift is played back in closed loop.
+"""
+
+import os
+import csv
+
+import numpy as np
+
+from dummy_wavemeter import DummyWavemeter
+from measurement_log import MeasurementLogReader, log_files, LOG_EXTENSION
+from clock import SYSTEM_CLOCK
+
+def _switch_channel_of(channel, channel_map):
+    """ Return the switch channel of the channel name or number, or -1 if it is unknown. """
+    if isinstance(channel, bytes):
+        channel = channel.decode()
+    if channel in channel_map:
+        return channel_map[channel]
+    try:
+        return int(channel)
+    except ValueError:
+        return -1
+
+def load_traces(file_path, channel_map=None):
+    """ Read the traces of a measurement log, a directory of them or a CSV file.
+        Return the dictionary of (switch channel, (times, frequencies, output voltages)),
+        each of which is a NumPy array in the order of time.
+    """
+    if channel_map is None:
+        channel_map = {}
+
+    samples = {}
+    if os.path.isdir(file_path) or file_path.endswith(LOG_EXTENSION):
+        if os.path.isdir(file_path):
+            file_paths = log_files(file_path)
+        else:
+            file_paths = [file_path]
+
+        for log_path in file_paths:
+            for channel_name, records in MeasurementLogReader(log_path).channels():
+                samples.setdefault(channel_name, []).append(np.stack((records['time'], \
+                    records['frequency'], records['output_voltage']), axis=1))
+    else:
+        rows = {}
+        with open(file_path, newline='') as csv_file:
+            for row in csv.reader(csv_file):
+                try:
+                    sample = [float(row[0]), float(row[2]), float(row[3]) if len(row) > 3 else 0.0]
+                except (ValueError, IndexError):
+                    ### Header or broken row
+                    continue
+                rows.setdefault(row[1].strip(), []).append(sample)
+        samples = {channel: [np.array(channel_rows)] for channel, channel_rows in rows.items()}
+
+    traces = {}
+    for channel, sample_list in samples.items():
+        switch_channel = _switch_channel_of(channel, channel_map)
+        if switch_channel < 0:
+            # todo - exception
+            print("[Replay Wavemeter] Unknown channel in the trace -", channel)
+            continue
+
+        trace = np.concatenate(sample_list)
+        ### Error values (no signal, under/over exposure) are not interpolated
+        trace = trace[trace[:, 1] > 0]
+        if not len(trace):
+            continue
+        trace = trace[np.argsort(trace[:, 0], kind='stable')]
+        traces[switch_channel] = (trace[:, 0].copy(), trace[:, 1].copy(), trace[:, 2].copy())
+    return traces
+
+class ReplayWavemeter(DummyWavemeter):
+    def __init__(self, file_path, speed=1.0, loop=False, voltage_response=0.0, channel_map=None, \
+        clock=SYSTEM_CLOCK):
+        self.file_path = file_path
+        self.speed = float(speed)
+        self.loop = loop
+        self.voltage_response = float(voltage_response)
+        self.channel_map = channel_map if channel_map is not None else {}
+        super().__init__(clock)
+
+        ### switch channel -> (times, frequencies, output voltages)
+        self.traces = load_traces(file_path, self.channel_map)
+        if self.traces:
+            self.trace_start = min(trace[0][0] for trace in self.traces.values())
+            self.trace_end = max(trace[0][-1] for trace in self.traces.values())
+        else:
+            # todo - exception
+            print("[Replay Wavemeter] No trace to replay in", file_path)
+            self.trace_start = self.trace_end = 0.0
+        self.rewind()
+
+    def _init_parameters(self):
+        super()._init_parameters()
+        self.turned_on = 1
+        self.output_voltage = {}
+
+    def rewind(self):
+        """ Restart the replay from the beginning of the traces. """
+        self.replay_start = self.clock.time()
+
+    def replay_time(self):
+        """ Return the time of the traces being replayed, or None after the end of the traces. """
+        elapsed = (self.clock.time() - self.replay_start) * self.speed
+        duration = self.trace_end - self.trace_start
+        if elapsed > duration:
+            if not self.loop or duration <= 0:
+                return None
+            elapsed %= duration
+        return self.trace_start + elapsed
+
+    def Operation(self, parameter):
+        if parameter == self.cCtrlStartMeasurement:
+            self.rewind()
+        super().Operation(parameter)
+
+    def GetFrequencyNum(self, switch_channel, num):
+        if num != 0:
+            print("[Replay Wavemeter] Wrong - GetFrequencyNum(SWCh, 0)")
+            return 0
+
+        trace = self.traces.get(switch_channel)
+        replay_time = self.replay_time()
+        if trace is None or replay_time is None:
+            ### No value
+            return 0
+
+        times, frequencies, output_voltages = trace
+        frequency = np.interp(replay_time, times, frequencies)
+        if self.voltage_response and switch_channel in self.output_voltage:
+            frequency += self.voltage_response * \
+                (self.output_voltage[switch_channel] - np.interp(replay_time, times, output_voltages))
+        return float(frequency)
+
+    def SetOutputVoltage(self, switch_channel, output_voltage):
+        self.output_voltage[switch_channel] = output_voltage
@@ -0,0 +1,156 @@
+""" Wavemeter backend simulating the lasers behind the fiber switch.
+
+    Each switch channel has a laser whose frequency is
+        frequency + random walk drift + piezo offset + measurement noise
+    1. The drift is a random walk sampled on a fixed time grid of drift_step,
+      so the same seed gives the same drift regardless of when it is measured.
+    2. The piezo offset follows piezo_response * output voltage with the first
+      order lag of piezo_time_constant.
+    3. The signal of an exposure is signal_level * exposure time. Below
+      min_signal the result is ErrLowSignal(-3), above max_signal it is
+      ErrBigSignal(-4), as the wavemeter reports under/over exposure.
+    4. After the fiber switch moves, no value is available until the switch
+      has settled for switchDelay ms and one exposure has passed.
+
+    Every random number comes from generators seeded by seed and the switch
+    channel, so a run is reproducible.
+"""
+
+import numpy as np
+
+from dummy_wavemeter import DummyWavemeter
+from clock import SYSTEM_CLOCK
+
+class SimulatedLaser():
+    def __init__(self, frequency, rng, drift_rate, drift_step, piezo_response, piezo_time_constant, \
+        noise, signal_level, start_time):
+        self.frequency = frequency
+        self.rng = rng
+        self.drift_scale = drift_rate * np.sqrt(drift_step)
+        self.drift_step = drift_step
+        self.piezo_response = piezo_response
+        self.piezo_time_constant = piezo_time_constant
+        self.noise = noise
+        self.signal_level = signal_level
+
+        self.start_time = start_time
+        self.drift = 0.0
+        self.drift_index = 0
+        self.piezo_offset = 0.0
+        self.output_voltage = 0.0
+        self.last_time = start_time
+
+    def advance(self, now):
+        """ Evolve the drift and the piezo offset up to now. """
+        index = int((now - self.start_time) / self.drift_step)
+        if index > self.drift_index:
+            self.drift += self.drift_scale * self.rng.standard_normal(index - self.drift_index).sum()
+            self.drift_index = index
+
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            target = self.piezo_response * self.output_voltage
+            if self.piezo_time_constant > 0:
+                self.piezo_offset += (target - self.piezo_offset) * \
+                    (1 - np.exp(-elapsed / self.piezo_time_constant))
+            else:
+                self.piezo_offset = target
+            self.last_time = now
+
+    def set_output_voltage(self, now, output_voltage):
+        ### The voltage is constant between the changes, so the lag is exact
+        self.advance(now)
+        self.output_voltage = output_voltage
+
+    def measure(self, now):
+        self.advance(now)
+        return self.frequency + self.drift + self.piezo_offset + self.noise * self.rng.standard_normal()
+
+class SimulatedWavemeter(DummyWavemeter):
+    cExposureMin = 1
+    cExposureMax = 2000
+    ErrLowSignal = -3
+    ErrBigSignal = -4
+
+    def __init__(self, seed=0, frequencies=None, initial_offset=20e-6, drift_rate=1e-6, drift_step=0.01, \
+        piezo_response=0.02, piezo_time_constant=0.05, noise=0.1e-6, signal_level=60.0, \
+        min_signal=100.0, max_signal=3000.0, switch_delay=100, clock=SYSTEM_CLOCK):
+        """ frequencies : dictionary of (switch channel, center frequency in THz) of the lasers.
+              Each laser starts initial_offset * N(0, 1) away from its center frequency.
+            drift_rate : THz / sqrt(s) of the random walk.
+            piezo_response : THz per unit of the output voltage.
+            noise : THz of the white measurement noise.
+            signal_level : signal per ms of exposure, either a number or a dictionary of
+              (switch channel, signal level).
+        """
+        super().__init__(clock)
+        self.seed = seed
+        self.switchDelay = switch_delay
+        self.min_signal = min_signal
+        self.max_signal = max_signal
+
+        if frequencies is None:
+            frequencies = {channel: 811.28878 for channel in range(9)}
+
+        start_time = self.clock.time()
+        self.lasers = {}
+        for switch_channel, frequency in frequencies.items():
+            rng = np.random.default_rng([seed, switch_channel])
+            if isinstance(signal_level, dict):
+                level = signal_level.get(switch_channel, 60.0)
+            else:
+                level = signal_level
+            self.lasers[switch_channel] = SimulatedLaser(frequency + initial_offset * rng.standard_normal(), \
+                rng, drift_rate, drift_step, piezo_response, piezo_time_constant, noise, level, start_time)
+        self.switch_time = start_time
+        self.switcher_time = start_time
+
+    def _init_parameters(self):
+        super()._init_parameters()
+        self.turned_on = 1
+
+    def SetSwitcherChannel(self, switch_channel):
+        if switch_channel != self.switch_channel:
+            self.switch_time = self.clock.time()
+        self.switch_channel = switch_channel
+
+    def SetSwitcherMode(self, mode):
+        if mode and not self.switcher_mode:
+            self.switcher_time = self.clock.time()
+        self.switcher_mode = mode
+
+    def GetFrequencyNum(self, switch_channel, num):
+        if num != 0:
+            print("[Simulated Wavemeter] Wrong - GetFrequencyNum(SWCh, 0)")
+            return 0
+
+        laser = self.lasers.get(switch_channel)
+        if laser is None:
+            return 0
+        elif self.switcher_mode:
+            ### The switcher measures every channel in use on its own
+            if not self.signal_states.get(switch_channel, 0):
+                return 0
+            settle_start = self.switcher_time
+        elif switch_channel != self.switch_channel:
+            return 0
+        else:
+            settle_start = self.switch_time
+
+        now = self.clock.time()
+        exposure_time = self.exposure_time.get(switch_channel, 1)
+        if now < settle_start + 0.001 * (self.switchDelay + exposure_time):
+            ### Fiber switch is settling
+            return 0
+
+        signal = laser.signal_level * exposure_time
+        if signal < self.min_signal:
+            return self.ErrLowSignal
+        elif signal > self.max_signal:
+            return self.ErrBigSignal
+        return float(laser.measure(now))
+
+    def SetOutputVoltage(self, switch_channel, output_voltage):
+        laser = self.lasers.get(switch_channel)
+        if laser is not None:
+            laser.set_output_voltage(self.clock.time(), output_voltage)
@@ -8,22 +8,76 @@
     current frequency with specifying the switch channel.
 """
 
-import time
 import os
+import importlib
+
+import numpy as np
 
-# from highfinesse_wavemeter_v0_01 import HighfinesseWavemeter as WM
-from dummy_wavemeter import DummyWavemeter as WM
 from constant import *
+from clock import SYSTEM_CLOCK
+
+### Backends of Wavemeter : name -> "module:class" or a callable creating the backend.
+### The module is imported only when its backend is created, so the DLL of a wavemeter
+### is never loaded unless that backend is selected.
+WAVEMETER_BACKENDS = {
+    'highfinesse': 'highfinesse_wavemeter_v0_01:HighfinesseWavemeter',
+    'dummy': 'dummy_wavemeter:DummyWavemeter',
+    'replay': 'replay_wavemeter:ReplayWavemeter',
+    'simulator': 'simulated_wavemeter:SimulatedWavemeter'
+}
+DEFAULT_BACKEND = 'dummy'
+### Time in s for which the status of the program is reused without asking the wavemeter
+DEFAULT_STATUS_TTL = 1.0
+
+def register_backend(name, factory):
+    """ Register factory(**options) creating the backend, or "module:class" of it. """
+    WAVEMETER_BACKENDS[name] = factory
+
+def create_backend(name, **options):
+    if name not in WAVEMETER_BACKENDS:
+        raise ValueError("Unknown wavemeter backend %s" % name)
+
+    factory = WAVEMETER_BACKENDS[name]
+    if isinstance(factory, str):
+        module_name, class_name = factory.split(':')
+        factory = getattr(importlib.import_module(module_name), class_name)
+    return factory(**options)
 
 class Wavemeter():
-    def __init__(self):
-        self.WM = WM()
+    def __init__(self, backend=DEFAULT_BACKEND, clock=SYSTEM_CLOCK, status_ttl=DEFAULT_STATUS_TTL, **options):
+        """ backend is a name in WAVEMETER_BACKENDS, and options are passed to the backend.
+            A clock other than the system clock is passed to the backend as well, which only
+            the simulating backends accept.
+
+            The status of the program is cached for status_ttl s. The listeners added by
+            add_status_listener are called when the program is turned on or off, or the
+            measurement is started or stopped.
+        """
+        self.backend = backend
+        self.clock = clock
+        if clock is not SYSTEM_CLOCK:
+            options['clock'] = clock
+        self.WM = create_backend(backend, **options)
 
         self._init_parameters()
-        self.status = self._get_current_status()
+        self.status_ttl = status_ttl
+        self.measuring = False
+        self._status_listeners = []
+        self._status = self._get_current_status()
+        self._status_time = self.clock.time()
 
     def _init_parameters(self):
         self.switch_delay = self.WM.switchDelay
+        self.cExposureMin = self.WM.cExposureMin
+        self.cExposureMax = self.WM.cExposureMax
+        self.event_mode = False
+        self.pattern = None
+        ### Only the backends simulating the lasers take the output voltage
+        self._set_output_voltage = getattr(self.WM, 'SetOutputVoltage', None)
+        self._enable_patterns = getattr(self.WM, 'enable_patterns', None)
+        self.interferometer_enabled = False
+        self.switcher_mode = False
+        self.switcher_channels = []
 
     def _get_current_status(self):
         """ Returns positive value if the program is turned on.
@@ -31,39 +85,87 @@ class Wavemeter():
         """
         return self.WM.Instantiate(-1, 0, 0, 0)
 
+    @property
+    def status(self):
+        return self.get_status()
+
+    def get_status(self):
+        """ Return the status of the program, which is asked to the wavemeter only if the
+            cached one is older than status_ttl s.
+        """
+        if self.clock.time() - self._status_time >= self.status_ttl:
+            return self.refresh_status()
+        return self._status
+
+    def refresh_status(self):
+        """ Ask the status of the program to the wavemeter and notify the listeners if it
+            has been turned on or off since the last time.
+        """
+        status = self._get_current_status()
+        self._status_time = self.clock.time()
+        changed = (status > 0) != (self._status > 0)
+        self._status = status
+        if status <= 0 and self.measuring:
+            ### The program is closed while measuring
+            self.measuring = False
+            changed = True
+
+        if changed:
+            self._notify_status()
+        return status
+
+    def add_status_listener(self, callback):
+        """ callback(program_on, measuring) is called in the thread which finds the change """
+        self._status_listeners.append(callback)
+
+    def _notify_status(self):
+        for callback in self._status_listeners:
+            callback(self._status > 0, self.measuring)
+
+    def _set_measuring(self, measuring):
+        if measuring == self.measuring:
+            return
+        self.measuring = measuring
+        self._notify_status()
+
     def run_program(self):
         """ If the program is not running, run the program in the
             designated path.
         """
-        if self._get_current_status() == 0:
+        if self.get_status() == 0:
             # todo - how to determine highfinesse wavemeter program path?
             # os.startfile("C:/")
-            time.sleep(5)
+            self.clock.sleep(5)
+            self.refresh_status()
 
     def exit_program(self):
         """ If the program is running, stop the measurement and exit the program
             with the TASKKILL command.
         """
-        if self._get_current_status() > 0:
-            self.stop_program()
+        if self.get_status() > 0:
+            self.stop_measurement()
             # todo - determine the name of the process of the Highfiness wavemeter
             os.system("TASKKILL /F /IM ((todo - name of the process))")
+            self.refresh_status()
 
     def start_measurement(self):
         """ If the program is running, start measurement, which is
             same with clicking the "start" button in the program.
         """
-        if self._get_current_status() > 0:
+        status = self.get_status()
+        if status > 0:
             self.WM.Operation(self.WM.cCtrlStartMeasurement)
-        elif self._get_current_status() == 0:
+            self._set_measuring(True)
+        elif status == 0:
             self.run_program()
 
     def stop_measurement(self):
         """ If the program is running, stop measurement, which is
             same with clicking the "stop" button in the program.
         """
-        if self._get_current_status() > 0:
+        if self.get_status() > 0:
             self.WM.Operation(self.WM.cCtrlStopAll)
+            self._set_measuring(False)
 
     def set_switch_channel(self, switch_channel):
         """ Check the range of switch channel (0~8) and call API
@@ -100,12 +202,151 @@ class Wavemeter():
 
         return self.WM.GetFrequencyNum(switch_channel, 0)
 
+    def enable_switcher_mode(self, switch_channels):
+        """ Let the switcher of the wavemeter cycle through the switch channels by itself at
+            its own rate, so the latest results of all of them are read at once with
+            get_all_frequencies. The other switch channels are left out of the cycle.
+
+            Return 0 in success, negative value otherwise.
+        """
+        switch_channels = sorted(set(switch_channels))
+        for switch_channel in switch_channels:
+            if switch_channel < 0 or switch_channel > 8:
+                return OUT_OF_RANGE
+
+        if self.switcher_mode and switch_channels == self.switcher_channels:
+            return 0
+
+        for switch_channel in self.switcher_channels:
+            if switch_channel not in switch_channels:
+                self.WM.SetSwitcherSignalStates(switch_channel, 0, 0)
+        for switch_channel in switch_channels:
+            if switch_channel not in self.switcher_channels:
+                self.WM.SetSwitcherSignalStates(switch_channel, 1, 1)
+        self.switcher_channels = switch_channels
+
+        if not self.switcher_mode:
+            self.WM.SetSwitcherMode(1)
+            self.switcher_mode = True
+        return 0
+
+    def disable_switcher_mode(self):
+        """ Give the switch back to set_switch_channel. """
+        if self.switcher_mode:
+            self.WM.SetSwitcherMode(0)
+        self.switcher_mode = False
+        self.switcher_channels = []
+
+    def get_switcher_cycle_time(self, exposure_times):
+        """ Return the time in ms the switcher takes to measure every channel once, given
+            the list of the exposure times of the channels.
+        """
+        return sum(exposure_times) + self.switch_delay * len(exposure_times)
+
+    def get_all_frequencies(self, switch_channels):
+        """ Read the latest results of the switch channels in the switcher mode.
+
+            Return the list of the results in the order of switch_channels, or negative
+            value if a switch channel is out of range.
+        """
+        for switch_channel in switch_channels:
+            if switch_channel < 0 or switch_channel > 8:
+                return OUT_OF_RANGE
+
+        get_frequency = self.WM.GetFrequencyNum
+        return [get_frequency(switch_channel, 0) for switch_channel in switch_channels]
+
+    def set_output_voltage(self, switch_channel, output_voltage):
+        """ Let the backend know the output voltage applied to the laser of the switch
+            channel. Backends replaying or simulating the lasers make the frequency follow
+            it, and the others ignore it.
+
+            Return 0 in success, negative value otherwise.
+        """
+        if switch_channel < 0 or switch_channel > 8:
+            return OUT_OF_RANGE
+
+        if self._set_output_voltage is not None:
+            self._set_output_voltage(switch_channel, output_voltage)
+        return 0
+
+    def enable_event_mode(self, timeout):
+        """ Install the wait event of the wavemeter so that new measurement results
+            are announced through WaitForWLMEvent. timeout is the maximum time in ms
+            that a single wait blocks.
+
+            Return 0 in success, negative value otherwise.
+        """
+        if self.WM.Instantiate(self.WM.cInstNotification, self.WM.cNotifyInstallWaitEvent, \
+            timeout, 0) <= 0:
+            self.event_mode = False
+            return -1
+
+        self.event_mode = True
+        return 0
+
+    def disable_event_mode(self):
+        """ Remove the wait event installed by enable_event_mode. """
+        if self.event_mode:
+            self.WM.Instantiate(self.WM.cInstNotification, self.WM.cNotifyRemoveWaitEvent, 0, 0)
+        self.event_mode = False
+
+    def wait_for_frequency(self, switch_channel, switch_time, timeout):
+        """ Block until the wavemeter publishes a new result of the switch channel and
+            return it. Results announced before the fiber switch has settled, which is
+            switch_delay ms after switch_time, are discarded.
+
+            Return 0(no value) if nothing arrives within timeout ms, OUT_OF_RANGE for
+            the invalid switch channel.
+        """
+        if switch_channel < 0 or switch_channel > 8:
+            return OUT_OF_RANGE
+
+        settle_time = switch_time + 0.001 * self.switch_delay
+        deadline = self.clock.time() + 0.001 * timeout
+        while self.clock.time() < deadline:
+            mode = self.WM.WEvent()
+            if self.WM.event_result < 0:
+                ### Wait event is not installed
+                break
+            elif self.WM.event_result == 0:
+                continue
+
+            if self.WM.EventChannel(mode) != switch_channel or self.clock.time() < settle_time:
+                continue
+
+            return self.WM.GetFrequencyNum(switch_channel, 0)
+
+        return 0
+
+    def enable_interferometer(self, enable=True):
+        """ Let the wavemeter export the interferometer patterns, which slows down each
+            measurement, or stop it. It is enabled only while a client subscribes to them.
+        """
+        if self._enable_patterns is not None and enable != self.interferometer_enabled:
+            self._enable_patterns(enable)
+        self.interferometer_enabled = enable
+
     def get_current_interferometer(self, switch_channel):
+        """ Check the range of switch channel (0~8) and read the patterns of both
+            interferometers into the reusable buffer.
+
+            Return the buffer as a NumPy array of shape (2, number of pattern items)
+            in success, negative value otherwise. The wavemeter writes into the array
+            directly, so it is overwritten by the next call.
+        """
         if switch_channel < 0 or switch_channel > 8:
             return OUT_OF_RANGE
 
-        # todo - call API to get the interferometer data
+        if self.pattern is None:
+            self.pattern = np.zeros((2, self.WM.l1), dtype=np.uint16)
+
+        self.WM.GetPatternDataNum(switch_channel, self.WM.cSignal1Interferometers, \
+            self.pattern[0].ctypes.data)
+        self.WM.GetPatternDataNum(switch_channel, self.WM.cSignal1WideInterferometer, \
+            self.pattern[1].ctypes.data)
+        return self.pattern
 
 if __name__ == "__main__":
     wavemeter = Wavemeter()
-    print("Current status : ", wavemeter._get_current_status())
+    print("Current status : ", wavemeter.status)
@@ -11,60 +11,124 @@
     PID if it is enabled.
 """
 
-import time
 import socket
 import os
+import math
+from collections import deque
+from functools import partial
+from types import MappingProxyType
 from configparser import ConfigParser
 
 from PyQt5.QtCore import *
-from PyQt5.QtWidgets import *
 
 from constant import *
 from wavemeter import *
+from work_queue import WorkQueue
+from command_table import CommandTable
+from channel_scheduler import SCHEDULERS, RoundRobinScheduler
+from channel_history import ChannelHistory, DEFAULT_HISTORY_SIZE
+from measurement_log import MeasurementLogWriter, encode_channel_name
+from clock import CLOCKS, SYSTEM_CLOCK
+from pid_core import PIDCore, PIDState
+from channel_snapshot import take_snapshot
+from message_frame import EncodedMessage
 
 _file_name = os.path.realpath(__file__)
 _home_dir = os.path.dirname(_file_name)
 
 class WavemeterController(QThread):
-    def __init__(self):
+    _coalesced_commands = ('TWL', 'TFR', 'EXP', 'VLT', 'PPP', 'III', 'DDD', 'GAN')
+    _target_commands = ('TWL', 'TFR')
+
+    def __init__(self, config_file=None, backend=None):
         """ Initialize internal data structures
             1. _server_status : Can have three values - stopped, started, and focused.
-            2. _work_list : List of message that should be handled. Messages include the
-              request to update the settings, save configurations, or reply server info.
+            2. _work_list : Bounded priority queue of messages that should be handled. Messages
+              include the request to update the settings, save configurations, or reply server
+              info. Control commands overtake the parameter updates, keeping their order, and
+              pending updates in _coalesced_commands are merged per (command, channel_name).
             3. _channel_list : Dictionary of current channel lists which are read from
               the config file. It has key-value pair of (channel_name, Channel object).
               Each Channel object has the list of name of monitoring clients internally.
-            4. _client_list : Dictionary of currently connected clients. It has key-value
+            4. _client_list : Read-only mapping of currently connected clients. It has key-value
               pair of (client_name, Client object). Each Client object has the list of name
-              of monitoring channels internally.
+              of monitoring channels internally. The mapping is never changed in place but
+              swapped in whole, so the PID loop iterates it while clients come and go.
+
+            config_file is the configuration file, config/<host name>.ini by default.
+            backend overrides the wavemeter backend of the configuration.
         """
         super().__init__()
-        self.wavemeter = Wavemeter()
+        self.config_file = config_file
+        self.wavemeter = None
+        self.clock = SYSTEM_CLOCK
+        self.clock_name = 'system'
         self.pid_loop = PIDLoop(self)
         self._server_status = SERVER_STATUS["stopped"]
         self._thread_status = THREAD_STATUS["standby"]
-        self._work_list = []
+        self._work_list = WorkQueue(WORK_QUEUE_CAPACITY)
         self._channel_list_prio_low =  {}
         self._channel_list_prio_high = {}
-        self._client_list = {}
-
-        self._mutex = QMutex()
-        self._cond = QWaitCondition()
+        self._client_list = MappingProxyType({})
+        self._client_mutex = QMutex()
+        self.event_mode = False
+        self.event_timeout = 1000
+        self.scheduler_name = 'round robin'
+        self.history_size = DEFAULT_HISTORY_SIZE
+        self.log_enabled = True
+        self.log_directory = os.path.join(_home_dir, 'log')
+        self.log_max_size = 64          # MB
+        self.measurement_log = None
+        self.backend_name = DEFAULT_BACKEND
+        self.replay_file = ''
+        self.replay_speed = 1.0
+        self.replay_loop = False
+        self.voltage_response = 0.0
+        self.simulator_seed = 0
+        self.status_ttl = DEFAULT_STATUS_TTL
+        self.switcher_mode = False
+        self.output_min = -math.inf
+        self.output_max = math.inf
+        self.anti_windup = True
+
+        self._command_table = CommandTable()
+        self._init_command_table()
 
         self.pid_loop.start()
 
         self._open_config()
+        if backend is not None:
+            self.backend_name = backend
+        self._open_wavemeter()
+        self.pid_core = PIDCore(self.max_frequency_offset, self.max_frequency_change, \
+            self.output_min, self.output_max, self.anti_windup)
+        self.snapshot = take_snapshot(0, self.clock.time(), self._server_status, self._channel_list_prio_low)
+        self._status_reply = None
+        self._status_reply_key = None
 
     def _open_config(self):
         """ Initialize channel list by reading configuration. """
-        _file_name = os.path.join(_home_dir, 'config', socket.gethostname() + ".ini")
-        if not os.path.isfile(_file_name):
-            _file_name = QFileDialog.getOpenFileName(self, 'Wavemeter Configuration File',
+        _file_name = self.config_file
+        if _file_name is None:
+            _file_name = os.path.join(_home_dir, 'config', socket.gethostname() + ".ini")
+        if not os.path.isfile(_file_name) and self.config_file is None:
+            ### Widgets are imported only to ask for the file, so a headless server never loads them
+            from PyQt5.QtWidgets import QFileDialog
+            _file_name = QFileDialog.getOpenFileName(None, 'Wavemeter Configuration File',
             os.path.join(_home_dir, 'config'))[0]
+        self.config_file = _file_name
 
         parser = ConfigParser()
         parser.read(_file_name)
 
+        ### The channels are created with the clock, so it is read before the sections
+        self.clock_name = parser.get('PID', 'clock', fallback='system')
+        if self.clock_name not in CLOCKS:
+            # todo - exception
+            self.clock_name = 'system'
+        if self.clock_name != 'system':
+            self.clock = CLOCKS[self.clock_name]()
+
         for section in parser.sections():
             if not section == 'PID' and not section.startswith('CH'):
                 # todo - exception
@@ -76,6 +140,24 @@ class WavemeterController(QThread):
                     self.auto_exposure_step = float(parser[section]['auto exposure step'])
                     self.max_frequency_offset = float(parser[section]['max freq offset'])
                     self.max_frequency_change = float(parser[section]['max freq change'])
+                    self.event_mode = parser[section].getboolean('event mode', fallback=False)
+                    self.event_timeout = int(parser[section].get('event timeout', fallback=1000))
+                    self.scheduler_name = parser[section].get('scheduler', fallback='round robin')
+                    self.history_size = int(parser[section].get('history size', fallback=DEFAULT_HISTORY_SIZE))
+                    self.log_enabled = parser[section].getboolean('measurement log', fallback=True)
+                    self.log_directory = parser[section].get('log directory', fallback=self.log_directory)
+                    self.log_max_size = int(parser[section].get('log max size', fallback=self.log_max_size))
+                    self.backend_name = parser[section].get('backend', fallback=DEFAULT_BACKEND)
+                    self.replay_file = parser[section].get('replay file', fallback='')
+                    self.replay_speed = float(parser[section].get('replay speed', fallback=1.0))
+                    self.replay_loop = parser[section].getboolean('replay loop', fallback=False)
+                    self.voltage_response = float(parser[section].get('voltage response', fallback=0.0))
+                    self.simulator_seed = int(parser[section].get('simulator seed', fallback=0))
+                    self.status_ttl = float(parser[section].get('status ttl', fallback=DEFAULT_STATUS_TTL))
+                    self.switcher_mode = parser[section].getboolean('switcher mode', fallback=False)
+                    self.output_min = float(parser[section].get('output min', fallback=-math.inf))
+                    self.output_max = float(parser[section].get('output max', fallback=math.inf))
+                    self.anti_windup = parser[section].getboolean('anti windup', fallback=True)
                 except:
                     # todo - exception
                     return
@@ -90,39 +172,183 @@ class WavemeterController(QThread):
                     i_value = int(parser[section]['ii'])
                     d_value = int(parser[section]['dd'])
                     gain = int(parser[section]['gain'])
+                    min_update_rate = float(parser[section].get('min update rate', fallback=0))
                 except:
                     # todo - exception
                     continue
 
+                try:
+                    ### The measurement log and the replay know the channels by their names
+                    encode_channel_name(name)
+                except ValueError as err:
+                    # todo - exception
+                    print("[Wavemeter controller] The channel %s is skipped -" % section, err)
+                    continue
+
                 self._channel_list_prio_low[name] = Channel(name, exposure_time, \
-                    [p_value, i_value, d_value, gain], fiber_switch, dac_channel, target_frequency)
+                    [p_value, i_value, d_value, gain], fiber_switch, dac_channel, target_frequency, \
+                    self.history_size, self.clock)
+                self._channel_list_prio_low[name].min_update_rate = min_update_rate
 
-    def _inform_clients(self, message, client_list):
+        if self.log_enabled:
+            self.measurement_log = MeasurementLogWriter(self.log_directory, self.log_max_size << 20)
+
+        if self.scheduler_name not in SCHEDULERS:
+            # todo - exception
+            self.scheduler_name = 'round robin'
+        self.pid_loop.scheduler = SCHEDULERS[self.scheduler_name](self)
+
+    def _open_wavemeter(self):
+        """ Create the wavemeter with the backend of the configuration. The replay backend
+            plays back the traces in replay_file, mapping the channel names to the fiber
+            switch channels of the configuration. The simulator places a laser at the target
+            frequency of each channel.
+        """
+        if self.backend_name not in WAVEMETER_BACKENDS:
+            # todo - exception
+            self.backend_name = DEFAULT_BACKEND
+        elif self.backend_name == 'replay' and not os.path.exists(self.replay_file):
+            ### Nothing to play back. Run with the default backend rather than fail to start.
+            print("[Wavemeter controller] The replay file '%s' in [PID] does not exist. Falling back" \
+                " to the %s backend." % (self.replay_file, DEFAULT_BACKEND))
+            self.backend_name = DEFAULT_BACKEND
+
+        options = {}
+        if self.backend_name == 'replay':
+            options = {
+                'file_path': self.replay_file,
+                'speed': self.replay_speed,
+                'loop': self.replay_loop,
+                'voltage_response': self.voltage_response,
+                'channel_map': {channel_name: channel_obj.fiber_switch \
+                    for channel_name, channel_obj in self._channel_list_prio_low.items()}
+            }
+        elif self.backend_name == 'simulator':
+            options = {
+                'seed': self.simulator_seed,
+                'frequencies': {channel_obj.fiber_switch: channel_obj.target_frequency \
+                    for channel_obj in self._channel_list_prio_low.values()}
+            }
+        self.wavemeter = Wavemeter(self.backend_name, self.clock, self.status_ttl, **options)
+        self.wavemeter.add_status_listener(self._inform_wavemeter_status)
+
+        for channel_obj in self._channel_list_prio_low.values():
+            self.wavemeter.set_exposure_num(channel_obj.fiber_switch, channel_obj.exposure_time)
+
+    def _inform_clients(self, message, client_list, batched=False):
         """ Send message to multiple clients. client_list is a string or a list of
-            clients' name.
+            clients' name. If batched is True, the message is a per-channel measurement
+            which is skipped for the clients receiving the batched CFB message.
+            The message is encoded once, and its frame is shared by all the clients.
         """
         if type(client_list) != list:
             client_list = [client_list]
+        elif len(client_list) > 1 and not isinstance(message, EncodedMessage):
+            message = EncodedMessage(message)
 
+        clients = self._client_list
         for client_name in client_list:
-            client_handler = self._client_list[client_name]
+            client_handler = clients.get(client_name)
+            if client_handler is None:
+                ### The client has disconnected meanwhile
+                continue
+            elif batched and client_handler.batched_frame:
+                continue
             client_handler.send_message(message)
 
+    def _inform_cycle_measurement(self, samples):
+        """ Send the measurements of one scan cycle in a single CFB message to each client
+            which opted in for the batched frame. Each client receives the channels that it
+            monitors only. The clients monitoring the same channels share the encoded message.
+
+            samples : list of [ channel name | frequency | output voltage | accumulator |
+                proportional | differentiator | measured time ]
+        """
+        messages = {}
+        for client_obj in self._client_list.values():   ### Snapshot of the clients
+            if not client_obj.batched_frame:
+                continue
+
+            data = [sample for sample in samples if sample[0] in client_obj.channel_list]
+            if not data:
+                continue
+            key = tuple(sample[0] for sample in data)
+            if key not in messages:
+                messages[key] = EncodedMessage(['D', 'WVM', 'CFB', data])
+            client_obj.send_message(messages[key])
+
     def _broadcast_clients(self, message):
         """ Broadcast message to all clients who are listening the wavemeter """
-        for client_handler in self._client_list.values():
+        clients = self._client_list
+        if len(clients) > 1 and not isinstance(message, EncodedMessage):
+            message = EncodedMessage(message)
+        for client_handler in clients.values():
             client_handler.send_message(message)
 
-    def _new_connection(self, client_name, client_handler):
+    def _new_connection(self, client_name, client_handler, options=[]):
         """ For the newly connecting client, enroll it to the client list and 
-            reply with the current server status to let the client initialize its
-            UI and data structures.
+            reply with the current server status (STA) and the status of the wavemeter
+            program (WST) to let the client initialize its UI and data structures.
+            options is the list of optional features requested by the client.
+              'CFB' : Receive the measurements of each scan cycle in a single CFB message
+                instead of the CFR, VLT and APD message per channel.
         """
         new_client_obj = Client(client_name, client_handler)
-        self._client_list[client_name] = new_client_obj
+        new_client_obj.batched_frame = 'CFB' in options
+        self._register_client(new_client_obj)
 
         message = ['C', 'WVM', 'STA', [self._server_status]]
         client_handler.toMessageList(message)
+        message = ['C', 'WVM', 'WST', [self.wavemeter.status > 0, self.wavemeter.measuring]]
+        client_handler.toMessageList(message)
+
+    def _register_client(self, client_obj):
+        """ Swap in a new client list including client_obj. """
+        self._client_mutex.lock()
+        try:
+            client_list = dict(self._client_list)
+            client_list[client_obj.name] = client_obj
+            self._client_list = MappingProxyType(client_list)
+        finally:
+            self._client_mutex.unlock()
+
+    def _unregister_client(self, client_obj):
+        """ Swap in a new client list without client_obj. A newer client of the same
+            name is kept.
+        """
+        self._client_mutex.lock()
+        try:
+            if self._client_list.get(client_obj.name) is not client_obj:
+                return
+            client_list = dict(self._client_list)
+            del client_list[client_obj.name]
+            self._client_list = MappingProxyType(client_list)
+        finally:
+            self._client_mutex.unlock()
+
+    def _inform_wavemeter_status(self, program_on, measuring):
+        """ Broadcast the change of the status of the wavemeter program """
+        message = ['C', 'WVM', 'WST', [program_on, measuring]]
+        self._broadcast_clients(message)
+
+    def _disconnect(self, requester):
+        """ Unsubscribe the disconnecting client from all channels and remove it from
+            the client list. The client stays in the list until no channel refers to it.
+        """
+        client_name = requester.user_name
+        client_obj = self._client_list.get(client_name)
+        if client_obj is None or client_obj.communcation_handler is not requester:
+            ### Unknown, or a newer client has connected with the same name meanwhile
+            return
+
+        for channel_name in client_obj.channel_list:
+            if channel_name in self._channel_list_prio_low.keys():
+                self._channel_list_prio_low[channel_name].remove_monitor_client(client_name)
+        ### ION subscribes to the patterns of a channel without UON, so every channel is checked
+        for channel_obj in self._channel_list_prio_low.values():
+            channel_obj.remove_interferometer_client(client_name)
+        self._update_interferometer_export()
+        self._unregister_client(client_obj)
 
     def _start_measurement(self, initial_channel_list, requester_handler):
         """ If the program is already started or focused, reply the current status
@@ -136,6 +362,8 @@ class WavemeterController(QThread):
 
         ### After starting the program, broadcast the change of the status to all users
         self.wavemeter.start_measurement()
+        if self.event_mode:
+            self.wavemeter.enable_event_mode(self.event_timeout)
         self._server_status = SERVER_STATUS["started"]
         self.pid_loop.activate_loop()
         message = ['C', 'WVM', 'STA', [self._server_status]]
@@ -150,6 +378,7 @@ class WavemeterController(QThread):
 
         ### After stopping the program, broadcast the change of the status to all users
         self.wavemeter.stop_measurement()
+        self.wavemeter.disable_event_mode()
         self._server_status = SERVER_STATUS["stopped"]
         self.pid_loop.inactivate_loop()
         message = ['C', 'WVM', 'STA', [self._server_status]]
@@ -165,11 +394,16 @@ class WavemeterController(QThread):
             2) Update channel_list of client designated by client_name
         """
         client_name = requester.user_name
-        client_obj = self._client_list[client_name]
+        client_obj = self._client_list.get(client_name)
+        if client_obj is None:
+            ### The client is not connected
+            self._reply_nak('UON', requester)
+            return
 
         for channel_name in channel_list:
-            if self._server_status == SERVER_STATUS["started"] and \
-                channel_name not in self._channel_list_prio_low.keys():
+            if channel_name not in self._channel_list_prio_low.keys():
+                ### Unknown channel, whatever the status of the server
+                self._reply_nak('UON', requester)
                 continue
             elif self._server_status == SERVER_STATUS["focused"] and \
                 channel_name not in self._channel_list_prio_high.keys():
@@ -193,6 +427,7 @@ class WavemeterController(QThread):
         except (KeyError, ValueError) as err:
             # todo - exception
             pass
+        self._update_interferometer_export()
 
     def _pid_on(self, channel_name, requester=None):
         ### Check that the channel_name is valid for pid on
@@ -310,12 +545,107 @@ class WavemeterController(QThread):
         message = ['C', 'WVM', 'AEF', [channel_name]]
         self._inform_clients(message, channel.monitor_list)
 
+    def _interferometer_on(self, channel_name, decimation, interval, requester):
+        """ Subscribe the requester to the interferometer patterns of the channel. The
+            patterns are sent every interval ms at most, keeping every decimation-th item.
+            Patterns are read only while the channel is measured, i.e. monitored.
+        """
+        if channel_name not in self._channel_list_prio_low.keys() or decimation < 1 or interval < 0:
+            # todo - exception
+            self._reply_nak('ION', requester)
+            return
+
+        channel = self._channel_list_prio_low[channel_name]
+        channel.add_interferometer_client(requester.user_name, decimation, interval)
+        self._update_interferometer_export()
+
+        message = ['C', 'WVM', 'ION', [channel_name, decimation, interval]]
+        self._inform_clients(message, requester.user_name)
+
+    def _interferometer_off(self, channel_name, requester):
+        if channel_name not in self._channel_list_prio_low.keys():
+            # todo - exception
+            return
+
+        channel = self._channel_list_prio_low[channel_name]
+        channel.remove_interferometer_client(requester.user_name)
+        self._update_interferometer_export()
+
+        message = ['C', 'WVM', 'IOF', [channel_name]]
+        self._inform_clients(message, requester.user_name)
+
+    def _update_interferometer_export(self):
+        """ The wavemeter exports the patterns only while a client subscribes to them """
+        self.wavemeter.enable_interferometer(any(channel_obj.interferometer_list \
+            for channel_obj in self._channel_list_prio_low.values()))
+
+    def _inform_interferometer(self, channel_name, measured_time, decimation, pattern, client_list):
+        """ Send the interferometer patterns as binary data. pattern is the array of shape
+            (2, number of items) of which each row is packed into bytes after decimation.
+        """
+        data = [channel_name, measured_time, decimation, \
+            pattern[0, ::decimation].tobytes(), pattern[1, ::decimation].tobytes()]
+        message = ['D', 'WVM', 'ITF', data]
+        self._inform_clients(message, client_list)
+
+    def _reply_history(self, channel_name, start_time, end_time, num_buckets, requester):
+        """ Reply the history of the channel measured in [start_time, end_time] as binary
+            float64 rows. If num_buckets is 0, each row is a record of the fields in
+            HISTORY_FIELDS. Otherwise, the window is reduced to at most num_buckets rows of
+            [ bucket start time | (min, max, mean) of each field except time ].
+            num_buckets is capped at the capacity of the history, and the reply carries
+            the number of buckets actually used. A reply too large for the 16-bit frame is
+            answered with NAK unless the client has asked for the extended frame (L32).
+        """
+        if channel_name not in self._channel_list_prio_low.keys() or type(num_buckets) != int \
+            or num_buckets < 0:
+            # todo - exception
+            self._reply_nak('HIS', requester)
+            return
+
+        history = self._channel_list_prio_low[channel_name].history
+        if num_buckets == 0:
+            rows = history.window(start_time, end_time)
+        else:
+            ### The window holds at most capacity records, so more buckets would only be empty
+            num_buckets = min(num_buckets, history.capacity)
+            rows = history.downsample(start_time, end_time, num_buckets)
+
+        message = EncodedMessage(['D', 'WVM', 'HIS', [channel_name, num_buckets, len(rows), rows.tobytes()]])
+        if message.frame(getattr(requester, 'extended_frame', False)) is None:
+            ### The client would never receive it. It should ask for a shorter window or fewer buckets.
+            self._reply_nak('HIS', requester)
+            return
+        self._inform_clients(message, requester.user_name)
+
+    def _reply_update_rate(self, requester):
+        """ Reply the achieved update rate (Hz) of every channel. """
+        data = [[channel_name, channel.update_rate] for channel_name, channel in self.snapshot.channels.items()]
+        message = ['C', 'WVM', 'UPR', data]
+        self._inform_clients(message, requester.user_name)
+
     def _reply_current_status(self, requester):
-        # todo - build server status message
-        message = ['D', 'WVM', 'WMS', []]
-        self._inform_clients(message, requester.username)
+        """ Reply the status of the server and every channel.
+            data : [0] server status / [1] list of [ channel name | fiber switch | target frequency |
+                current frequency | output voltage | exposure time | P | I | D | gain | pid on |
+                auto exposure on | measured time ]
 
-    def _update_current_frequency(self, channel_name, current_frequency):
+            The reply is built from the published snapshot and encoded once. It is reused
+            until a new snapshot is published or the server status changes.
+        """
+        snapshot = self.snapshot
+        if self._status_reply is None or self._status_reply_key[0] is not snapshot \
+            or self._status_reply_key[1] != self._server_status:
+            data = [[channel.name, channel.fiber_switch, channel.target_frequency, channel.current_frequency, \
+                channel.output_voltage, channel.exposure_time, channel.pp, channel.ii, channel.dd, channel.gain, \
+                channel.pid_on, channel.auto_exposure_on, channel.measured_time] \
+                for channel in snapshot.channels.values()]
+            self._status_reply = EncodedMessage(['D', 'WVM', 'WMS', [self._server_status, data]])
+            self._status_reply_key = (snapshot, self._server_status)
+
+        self._inform_clients(self._status_reply, requester.user_name)
+
+    def _update_current_frequency(self, channel_name, current_frequency, batched=False):
         if channel_name not in self._channel_list_prio_low.keys():
             # todo - exception
             return
@@ -324,7 +654,7 @@ class WavemeterController(QThread):
         channel.current_frequency = current_frequency
 
         message = ['D', 'WVM', 'CFR', [channel_name, current_frequency]]
-        self._inform_clients(message, channel.monitor_list)
+        self._inform_clients(message, channel.monitor_list, batched)
 
     def _update_target_frequency(self, channel_name, target_frequency):
         if channel_name not in self._channel_list_prio_low.keys():
@@ -344,20 +674,23 @@ class WavemeterController(QThread):
         
         channel = self._channel_list_prio_low[channel_name]
         channel.exposure_time = exposure_time
+        self.wavemeter.set_exposure_num(channel.fiber_switch, exposure_time)
 
         message = ['D', 'WVM', 'EXP', [channel_name, exposure_time]]
         self._inform_clients(message, channel.monitor_list)
 
-    def _update_output_voltage(self, channel_name, output_voltage):
+    def _update_output_voltage(self, channel_name, output_voltage, batched=False):
         if channel_name not in self._channel_list_prio_low.keys():
             # todo - exception
             return
         
         channel = self._channel_list_prio_low[channel_name]
+        channel.current_output_voltage = output_voltage
         # todo - command ArtyS7 to make specified output voltage
+        self.wavemeter.set_output_voltage(channel.fiber_switch, output_voltage)
 
         message = ['D', 'WVM', 'VLT', [channel_name, output_voltage]]
-        self._inform_clients(message, channel.monitor_list)
+        self._inform_clients(message, channel.monitor_list, batched)
 
     def _update_p_value(self, channel_name, p_value):
         if channel_name not in self._channel_list_prio_low.keys():
@@ -403,14 +736,14 @@ class WavemeterController(QThread):
         message = ['D', 'WVM', 'GAN', [channel_name, gain]]
         self._inform_clients(message, channel.monitor_list)
 
-    def _inform_apd_value(self, channel_name, data):
+    def _inform_apd_value(self, channel_name, data, batched=False):
         if channel_name not in self._channel_list_prio_low.keys():
             # todo - exception
             return
 
         channel = self._channel_list_prio_low[channel_name]
         message = ['D', 'WVM', 'APD', [channel_name, data[0], data[1], data[2]]]
-        self._inform_clients(message, channel.monitor_list)
+        self._inform_clients(message, channel.monitor_list, batched)
 
     def _capture_current_configuration(self, file_name=""):
         parser = ConfigParser()
@@ -424,25 +757,163 @@ class WavemeterController(QThread):
             'switch safe': self.switch_safe,
             'auto exposure step': self.auto_exposure_step,
             'max freq offset': self.max_frequency_offset,
-            'max freq change': self.max_frequency_change
+            'max freq change': self.max_frequency_change,
+            'event mode': self.event_mode,
+            'event timeout': self.event_timeout,
+            'scheduler': self.scheduler_name,
+            'history size': self.history_size,
+            'measurement log': self.log_enabled,
+            'log directory': self.log_directory,
+            'log max size': self.log_max_size,
+            'backend': self.backend_name,
+            'replay file': self.replay_file,
+            'replay speed': self.replay_speed,
+            'replay loop': self.replay_loop,
+            'voltage response': self.voltage_response,
+            'simulator seed': self.simulator_seed,
+            'status ttl': self.status_ttl,
+            'switcher mode': self.switcher_mode,
+            'output min': self.output_min,
+            'output max': self.output_max,
+            'anti windup': self.anti_windup,
+            'clock': self.clock_name
         }
-        for channel_name, channel_obj in self._channel_list_prio_low.items():
+        for channel_name, channel_obj in self.snapshot.channels.items():
             parser['CH'+str(channel_index)] = {
                 'name': channel_name,
                 'fiber switch': channel_obj.fiber_switch,
-                'dac channel': channel_obj.DAC_channel,
+                'dac channel': channel_obj.dac_channel,
                 'target frequency': channel_obj.target_frequency,
                 'exposure time': channel_obj.exposure_time,
                 'pp': channel_obj.pp,
                 'ii': channel_obj.ii,
                 'dd': channel_obj.dd,
-                'gain': channel_obj.gain
+                'gain': channel_obj.gain,
+                'min update rate': channel_obj.min_update_rate
             }
             channel_index += 1
 
         with open(file_path, 'w+') as config_file:
             parser.write(config_file)
 
+    def _init_command_table(self):
+        """ Register the handlers of the messages from the clients. Each handler is
+            called with the data list and the handler of the requesting client.
+            Handlers changing the channels or the subscriptions of the clients are posted
+            to the PID loop, which owns them.
+        """
+        table = self._command_table
+
+        ### data : [0] (str)client name / [1] (list, optional)requested options
+        table.register('C', 'CON', (str,), self._on_connection)
+        ### data : [0] (str)client name
+        table.register('C', 'DCN', (), self._on_disconnection)
+        ### data : [0] (list)list of initial channels
+        table.register('C', 'SRT', (list,), self._on_start_measurement)
+        ### no data (empty list)
+        table.register('C', 'STP', (), self._on_stop_measurement)
+        ### no data (empty list)
+        table.register('C', 'KIL', (), self._on_kill_program)
+        ### data : [0] (str)channel name
+        table.register('C', 'UON', (str,), self._on_user_on)
+        table.register('C', 'UOF', (str,), partial(self._post_channel_command, self._remove_user_from_channel))
+        table.register('C', 'PON', (str,), partial(self._post_channel_command, self._pid_on))
+        table.register('C', 'POF', (str,), partial(self._post_channel_command, self._pid_off))
+        table.register('C', 'FON', (str,), partial(self._post_channel_command, self._focus_on))
+        table.register('C', 'FOF', (str,), partial(self._post_channel_command, self._focus_off))
+        table.register('C', 'AEN', (str,), partial(self._post_channel_command, self._auto_exposure_on))
+        table.register('C', 'AEF', (str,), partial(self._post_channel_command, self._auto_exposure_off))
+        ### data : [0] (str)channel name / [1] (int)decimation / [2] (int)interval in ms
+        table.register('C', 'ION', (str, int, int), self._on_interferometer_on)
+        ### data : [0] (str)channel name
+        table.register('C', 'IOF', (str,), partial(self._post_channel_command, self._interferometer_off))
+        ### no data (empty list)
+        table.register('C', 'WMS', (), self._on_status_request)
+        table.register('C', 'UPR', (), self._on_update_rate_request)
+        ### data : [0] (str)channel name / [1] (float)start time / [2] (float)end time /
+        ###   [3] (int)number of buckets, 0 for raw records
+        table.register('C', 'HIS', (str, float, float, int), self._on_history_request)
+        ### data : [0] (str)file name
+        table.register('C', 'SCF', (str,), self._on_save_configuration)
+        ### NAK from the client is not answered to avoid the endless exchange of NAKs
+        table.register('C', 'NAK', (), self._on_nak)
+        # todo - register CAL and ACL once the calibration is implemented
+
+        ### data : [0] (str)channel name / [1] (float)target wavelength
+        table.register('D', 'TWL', (str, float), self._on_target_wavelength)
+        ### data : [0] (str)channel name / [1] (float)target frequency
+        table.register('D', 'TFR', (str, float), partial(self._post_channel_update, 'TFR', self._update_target_frequency))
+        ### data : [0] (str)channel name / [1] (int)exposure time
+        table.register('D', 'EXP', (str, int), partial(self._post_channel_update, 'EXP', self._update_exposure_time))
+        ### data : [0] (str)channel name / [1] (float)voltage
+        table.register('D', 'VLT', (str, float), partial(self._post_channel_update, 'VLT', self._update_output_voltage))
+        ### data : [0] (str)channel name / [1] (int)P, I, D gain and gain
+        table.register('D', 'PPP', (str, int), partial(self._post_channel_update, 'PPP', self._update_p_value))
+        table.register('D', 'III', (str, int), partial(self._post_channel_update, 'III', self._update_i_value))
+        table.register('D', 'DDD', (str, int), partial(self._post_channel_update, 'DDD', self._update_d_value))
+        table.register('D', 'GAN', (str, int), partial(self._post_channel_update, 'GAN', self._update_gain_value))
+
+    ### Handlers of the command table, called with the data list and the requester
+    def _on_connection(self, data, requester):
+        options = data[1] if len(data) > 1 and isinstance(data[1], list) else []
+        self._new_connection(data[0], requester, options)
+
+    def _on_disconnection(self, data, requester):
+        self.pid_loop.post(self._disconnect, requester)
+
+    def _on_start_measurement(self, data, requester):
+        self._start_measurement(data[0], requester)
+
+    def _on_stop_measurement(self, data, requester):
+        self._stop_measurement(requester)
+
+    def _on_kill_program(self, data, requester):
+        self._kill_program()
+
+    def _on_user_on(self, data, requester):
+        self.pid_loop.post(self._add_user_to_channel, [data[0]], requester)
+
+    def _on_interferometer_on(self, data, requester):
+        self.pid_loop.post(self._interferometer_on, data[0], data[1], data[2], requester)
+
+    def _on_status_request(self, data, requester):
+        self._reply_current_status(requester)
+
+    def _on_update_rate_request(self, data, requester):
+        self._reply_update_rate(requester)
+
+    def _on_history_request(self, data, requester):
+        self._reply_history(data[0], data[1], data[2], data[3], requester)
+
+    def _on_save_configuration(self, data, requester):
+        self._capture_current_configuration(data[0])
+
+    def _on_nak(self, data, requester):
+        pass
+
+    def _on_target_wavelength(self, data, requester):
+        self.pid_loop.post(self._update_target_frequency, data[0], unit_convert(data[1]), \
+            key=self._coalescing_key('D', 'TWL', data))
+
+    def _post_channel_command(self, function, data, requester):
+        """ Post function(channel name, requester) to the PID loop. """
+        self.pid_loop.post(function, data[0], requester)
+
+    def _post_channel_update(self, command, function, data, requester):
+        """ Post function(channel name, value) to the PID loop. It replaces the pending
+            update of the same command and channel, which the cycle running at the moment
+            has kept from being applied.
+        """
+        self.pid_loop.post(function, data[0], data[1], key=self._coalescing_key('D', command, data))
+
+    def register_command(self, control, command, schema, handler):
+        """ Plug in the handler(data, requester) of a new command. See CommandTable.register. """
+        self._command_table.register(control, command, schema, handler)
+
+    def _reply_nak(self, command, requester):
+        message = ['C', 'WVM', 'NAK', [command]]
+        requester.toMessageList(message)
+
     def toWorkList(self, message):
         """ Translates message to execute the proper functions.
             The argumnet cmd should be the list of four elements, which are control
@@ -463,117 +934,77 @@ class WavemeterController(QThread):
             client = message[3]
         except:
             # todo - exception
-            pass
+            return
+
+        if not self._command_table.validate(control, command, data):
+            ### Unknown command or data not matching the schema. The work list is spared.
+            self._reply_nak(command, client)
+            return
+
+        if not self._work_list.put(message, self._work_priority(control, command), \
+            self._coalescing_key(control, command, data)):
+            ### The work list is full. Let the client know that the message is dropped.
+            self._reply_nak(command, client)
+            return
 
-        self._work_list.append(message)
         if not self.isRunning():
             self.start()
-        if self._thread_status == THREAD_STATUS["standby"]:
-            self._cond.wakeAll()
+
+    def _work_priority(self, control, command):
+        """ Control commands should not wait behind the parameter updates. They keep their
+            order among themselves, e.g. STP after SRT of a client is not run before it.
+        """
+        if control == 'C':
+            return WORK_PRIORITY["control"]
+        return WORK_PRIORITY["update"]
+
+    def _coalescing_key(self, control, command, data):
+        """ Parameter updates of the same command and channel are merged in the work list
+            and in the commands posted to the PID loop, so only the latest value is applied
+            and broadcast. TWL and TFR both set the
+            target frequency, so they share a key to keep the latest of the two.
+            Messages without a valid channel name are never merged, although toWorkList
+            has answered them with NAK already.
+        """
+        if control != 'D' or command not in self._coalesced_commands or not data \
+            or not isinstance(data[0], str):
+            return None
+        elif command in self._target_commands:
+            return ('target', data[0])
+        return (command, data[0])
+
+    def shutdown(self):
+        """ Stop the threads of the controller and the measurement. The works already in
+            the work list are handled, the PID loop finishes its cycle, and the measurement
+            log writes its pending records before closing the file.
+        """
+        self._work_list.close()
+        self.wait()
+        self.pid_loop.stop()
+        if self._server_status != SERVER_STATUS["stopped"]:
+            self.wavemeter.stop_measurement()
+            self._server_status = SERVER_STATUS["stopped"]
+        if self.measurement_log is not None:
+            self.measurement_log.stop()
 
     def run(self):
+        dispatch = self._command_table.dispatch
         while True:
-            self._mutex.lock()
-            while len(self._work_list):
-                self._thread_status = THREAD_STATUS["running"]
-
-                work = self._work_list.pop(0)
-                control = work[0]
-                command = work[1]
-                data = work[2]
-                client_handler = work[3]
-
-                if control == 'C':
-                    if command == 'CON':
-                        ### data : [0] (str)client name
-                        self._new_connection(data[0], client_handler)
-                    elif command == 'DCN':
-                        # todo
-                        pass
-                    elif command == 'SRT':
-                        ### data : [0] (list)list of initial channels
-                        self._start_measurement(data[0], client_handler)
-                    elif command == 'STP':
-                        ### no data (empty list)
-                        self._stop_measurement()
-                    elif command == 'KIL':
-                        ### no data (empty list)
-                        self._kill_program()
-                    elif command == 'UON':
-                        ### data : [0] (str)channel name
-                        self._add_user_to_channel([data[0]], client_handler)
-                    elif command == 'UOF':
-                        ### data : [0] (str)channel name
-                        self._remove_user_from_channel(data[0], client_handler)
-                    elif command == 'PON':
-                        ### data : [0] (str)channel name
-                        self._pid_on(data[0], client_handler)
-                    elif command == 'POF':
-                        ### data : [0] (str)channel name
-                        self._pid_off(data[0], client_handler)
-                    elif command == 'FON':
-                        ### data : [0] (str)channel name
-                        self._focus_on(data[0], client_handler)
-                    elif command == 'FOF':
-                        ### data : [0] (str)channel name
-                        self._focus_off(data[0], client_handler)
-                    elif command == 'AEN':
-                        ### data : [0] (str)channel name
-                        self._auto_exposure_on(data[0], client_handler)
-                    elif command == 'AEF':
-                        ### data : [0] (str)channel name
-                        self._auto_exposure_off(data[0], client_handler)
-                    elif command == 'WMS':
-                        ### no data (empty list)
-                        self._reply_current_status(client_handler)
-                    elif command == 'SCF':
-                        ### data : [0] (str)file name
-                        self._capture_current_configuration(data[0])
-                    elif command == 'CAL':
-                        # todoo
-                        pass
-                    elif command == 'ACL':
-                        # todoo
-                        pass
-                    elif command == 'NAK':
-                        # todo - exception
-                        pass
-                elif control == 'D':
-                    if command == 'TWL':
-                        ### data : [0] (str)channel name / [1] (float)target wavelength
-                        frequency = unit_convert(data[1])
-                        self._update_target_frequency(data[0], frequency)
-                    elif command == 'TFR':
-                        ### data : [0] (str)channel name / [1] (float)target frequency
-                        self._update_target_frequency(data[0], data[1])
-                    elif command == 'EXP':
-                        ### data : [0] (str)channel name / [1] (int)exposure time
-                        self._update_exposure_time(data[0], data[1])
-                    elif command == 'VLT':
-                        ### data : [0] (str)channel name / [1] (float)voltage
-                        self._update_output_voltage(data[0], data[1])
-                    elif command == 'PPP':
-                        ### data : [0] (str)channel name / [1] (int)P gain
-                        self._update_p_value(data[0], data[1])
-                    elif command == 'III':
-                        ### data : [0] (str)channel name / [1] (int)I gain
-                        self._update_i_value(data[0], data[1])
-                    elif command == 'DDD':
-                        ### data : [0] (str)channel name / [1] (int)D gain
-                        self._update_d_value(data[0], data[1])
-                    elif command == 'GAN':
-                        ### data : [0] (str)channel name / [1] (int)gain
-                        self._update_gain_value(data[0], data[1])
-                    else:
-                        # todo - exception
-                        pass
-                else:
-                    # todo - exception
-                    pass
-
             self._thread_status = THREAD_STATUS["standby"]
-            self._cond.wait(self._mutex)
-            self._mutex.unlock()
+            work = self._work_list.get()
+            if work is None:
+                ### The work list is closed by shutdown
+                return
+            self._thread_status = THREAD_STATUS["running"]
+
+            control = work[0]
+            command = work[1]
+            data = work[2]
+            client_handler = work[3]
+
+            if not dispatch(control, command, data, client_handler):
+                ### The command is unregistered after the message is validated
+                self._reply_nak(command, client_handler)
 
 class PIDLoop(QThread):
     signal_new_measured_data = pyqtSignal(str, float)   # channel name, current frequency
@@ -585,8 +1016,23 @@ class PIDLoop(QThread):
         super().__init__()
         self.controller = controller
         self.is_running = False
+        self.scheduler = RoundRobinScheduler(controller)
+        self.switch_position = None
+        self.switch_time = controller.clock.time()
+        self.time_consumed = 0
         self.mutex = QMutex()
+        ### Commands changing the channels, run in this thread between the cycles.
+        ### The idle loop waits on wait_condition with _command_mutex, which guards the
+        ### check for new commands and is_running, so no wakeup is lost.
+        ### A command posted with a key replaces the pending command of the same key.
+        self._commands = deque()
+        self._pending_commands = {}
+        self._command_mutex = QMutex()
         self.wait_condition = QWaitCondition()
+        self._quit = False
+        self.cycle_count = 0
+        ### Number of commands merged into the pending command of the same key
+        self.merged_count = 0
 
         self.signal_new_measured_data.connect(self.controller._update_current_frequency)
         self.signal_new_exposure_time.connect(self.controller._update_exposure_time)
@@ -594,17 +1040,77 @@ class PIDLoop(QThread):
         self.signal_new_apd_value.connect(self.controller._inform_apd_value)
 
     def _measure_frequency(self, channel_name, channel_obj):
-        self.controller.wavemeter.set_switch_channel(channel_obj.fiber_switch)
-        total_exposure = channel_obj.exposure_time + self.controller.wavemeter.switch_delay
-        self.time_consumed += total_exposure
-        time.sleep(0.001 * total_exposure)
+        clock = self.controller.clock
+        start_time = clock.time()
+        switch_moved = self._switch_to(channel_obj)
+        if self.controller.wavemeter.event_mode:
+            ### Consume the result as soon as the wavemeter publishes it
+            current_frequency = self.controller.wavemeter.wait_for_frequency(channel_obj.fiber_switch, \
+                self.switch_time, self.controller.event_timeout)
+            self.time_consumed += 1000 * (clock.time() - start_time)
+        else:
+            total_exposure = channel_obj.exposure_time
+            if switch_moved:
+                total_exposure += self.controller.wavemeter.switch_delay
+            self.time_consumed += total_exposure
+            clock.sleep(0.001 * total_exposure)
+
+            current_frequency = self.controller.wavemeter.get_current_frequency(channel_obj.fiber_switch)
+        self._update_measurement(channel_name, channel_obj, current_frequency)
+
+    def _measure_switcher(self, schedule):
+        """ Measure the channels of the schedule in the switcher mode. The switcher of the
+            wavemeter cycles through their switch channels on its own, and the latest results
+            of all of them are read at once after a cycle of the switcher. If the wavemeter
+            refuses the switcher mode or the results, the channels are measured one by one
+            in this cycle.
+        """
+        ### A channel scheduled twice in the cycle would be updated twice from the same reading
+        schedule = list(dict(schedule).items())
+
+        wavemeter = self.controller.wavemeter
+        switch_channels = [channel_obj.fiber_switch for channel_name, channel_obj in schedule]
+        if wavemeter.enable_switcher_mode(switch_channels) < 0:
+            # todo - exception
+            self._measure_channels(schedule)
+            return
+        self.switch_position = None
+
+        ### The channels sharing a switch channel are measured once
+        exposure_times = {channel_obj.fiber_switch: channel_obj.exposure_time \
+            for channel_name, channel_obj in schedule}
+        cycle_time = wavemeter.get_switcher_cycle_time(list(exposure_times.values()))
+        self.time_consumed += cycle_time
+        self.controller.clock.sleep(0.001 * cycle_time)
 
-        current_frequency = self.controller.wavemeter.get_current_frequency(channel_obj.fiber_switch)
-        previous_weighted_frequency = channel_obj.weighted_frequency
+        frequencies = wavemeter.get_all_frequencies(switch_channels)
+        if type(frequencies) == int:
+            # todo - exception
+            self._measure_channels(schedule)
+            return
+
+        for (channel_name, channel_obj), current_frequency in zip(schedule, frequencies):
+            self._update_measurement(channel_name, channel_obj, current_frequency)
+            self._record_measurement(channel_obj)
+
+    def _measure_channels(self, schedule):
+        """ Measure the channels of the schedule one by one, moving the fiber switch. """
+        for channel_name, channel_obj in schedule:
+            self._measure_frequency(channel_name, channel_obj)
+            self._record_measurement(channel_obj)
+
+    def _update_measurement(self, channel_name, channel_obj, current_frequency):
+        """ Update the channel with the measured frequency, adjusting the exposure or running
+            the PID on it.
+        """
+        clock = self.controller.clock
         previous_time = channel_obj.current_time
-        channel_obj.current_time = time.time()
+        channel_obj.current_time = clock.time()
+        channel_obj.record_update(previous_time)
         # todo - debug self.signal_new_measured_data.emit(channel_name, current_frequency)
-        self.controller._update_current_frequency(channel_name, current_frequency)
+        self.controller._update_current_frequency(channel_name, current_frequency, True)
+        if channel_obj.interferometer_list:
+            self._stream_interferometer(channel_name, channel_obj)
 
         if current_frequency == 0:
             ### No signal
@@ -613,7 +1119,9 @@ class PIDLoop(QThread):
         elif current_frequency == -3:
             ###
             if channel_obj.auto_exposure_on:
-                new_exp = int(channel_obj.exposure_time * self.controller.auto_exposure_step)
+                ### Step at least 1 ms, or short exposures never change
+                new_exp = max(int(channel_obj.exposure_time * self.controller.auto_exposure_step), \
+                    channel_obj.exposure_time + 1)
                 if new_exp > self.controller.wavemeter.cExposureMax:
                     new_exp = self.controller.wavemeter.cExposureMax
                 # todo - debug self.signal_new_exposure_time.emit(channel_name, new_exp)
@@ -622,128 +1130,322 @@ class PIDLoop(QThread):
         elif current_frequency == -4:
             ###
             if channel_obj.auto_exposure_on:
-                new_exp = int(channel_obj.exposure_time / self.controller.auto_exposure_step)
+                new_exp = min(int(channel_obj.exposure_time / self.controller.auto_exposure_step), \
+                    channel_obj.exposure_time - 1)
                 if new_exp < self.controller.wavemeter.cExposureMin:
                     new_exp = self.controller.wavemeter.cExposureMin
                 # todo - debug self.signal_new_exposure_time.emit(channel_name, new_exp)
                 self.controller._update_exposure_time(channel_name, new_exp)
             return
 
-        ### If the frequency changes abruptly (more than 1 GHz), set weighted frequency equal to
-        ### the current freuqency. Otherwise, apply weight 0.9 to the current frequency and 0.1 to
-        ### the previous weighted frequency.
-        if abs(channel_obj.current_frequency - channel_obj.weighted_frequency) > 0.001:
-            channel_obj.weighted_frequency = channel_obj.current_frequency
-        else:
-            channel_obj.weighted_frequency \
-                = channel_obj.current_frequency * 0.9 + channel_obj.weighted_frequency * 0.1
-
-        if not channel_obj.pid_on:
+        ### The weighted frequency follows the measurement even when the PID is off
+        delta_t = channel_obj.current_time - previous_time
+        new_output = self.controller.pid_core.step(channel_obj.pid_state, current_frequency, delta_t, \
+            channel_obj.recent_output_voltage, channel_obj.pid_on)
+        if new_output is None:
             return
 
-        frequency_offset = channel_obj.weighted_frequency - channel_obj.target_frequency
-        if frequency_offset > self.controller.max_frequency_offset:
-            frequency_offset = self.controller.max_frequency_offset
-
-        delta_t = channel_obj.current_time - previous_time
-        delta_f = channel_obj.weighted_frequency - previous_weighted_frequency
-        if delta_f > self.controller.max_frequency_change:
-            delta_f = self.controller.max_frequency_change
-
-        channel_obj.accumulator = channel_obj.accumulator + channel_obj.ii * frequency_offset * delta_t
-        channel_obj.proportional = channel_obj.pp * frequency_offset
-        channel_obj.differentiator = channel_obj.dd * delta_f / delta_t
-        new_output = channel_obj.recent_output_voltage + \
-            (channel_obj.accumulator + channel_obj.proportional + channel_obj.differentiator) * channel_obj.gain
         # todo - debug self.signal_new_output.emit(channel_name, new_output)
         # todo - debugself.signal_new_apd_value.emit(channel_name, [channel_obj.accumulator, channel_obj.proportional, \
         #    channel_obj.differentiator])
-
-        self.controller._update_output_voltage(channel_name, new_output)
+        self.controller._update_output_voltage(channel_name, new_output, True)
         self.controller._inform_apd_value(channel_name, [channel_obj.accumulator, channel_obj.proportional, \
-            channel_obj.differentiator])
+            channel_obj.differentiator], True)
+
+    def _stream_interferometer(self, channel_name, channel_obj):
+        """ Read the interferometer patterns while the fiber switch is at the channel and send
+            them to the subscribers whose interval has passed. The patterns are read once and
+            encoded once per decimation.
+        """
+        now = self.controller.clock.time()
+        due_clients = {}
+        for client_name, subscription in list(channel_obj.interferometer_list.items()):
+            ### subscription : [0] decimation / [1] interval in ms / [2] last sent time
+            if now - subscription[2] < 0.001 * subscription[1]:
+                continue
+            subscription[2] = now
+            due_clients.setdefault(subscription[0], []).append(client_name)
+
+        if not due_clients:
+            return
+
+        pattern = self.controller.wavemeter.get_current_interferometer(channel_obj.fiber_switch)
+        if type(pattern) == int:
+            # todo - exception
+            return
+
+        for decimation, client_list in due_clients.items():
+            self.controller._inform_interferometer(channel_name, channel_obj.current_time, decimation, \
+                pattern, client_list)
+
+    def _switch_to(self, channel_obj):
+        """ Move the fiber switch to the channel. The safety margin before switching is paid
+            only when the switch actually changes its position, and skipped in the event mode
+            as results measured before the fiber switch settles are discarded anyway.
+
+            Return True if the switch moved.
+        """
+        if self.controller.wavemeter.switcher_mode:
+            ### The switcher gives the switch back, e.g. to the focused channel
+            self.controller.wavemeter.disable_switcher_mode()
+            self.switch_position = None
+
+        if channel_obj.fiber_switch == self.switch_position:
+            return False
+
+        if not self.controller.wavemeter.event_mode:
+            self.time_consumed += self.controller.switch_safe
+            self.controller.clock.sleep(0.001 * self.controller.switch_safe)
+
+        self.controller.wavemeter.set_switch_channel(channel_obj.fiber_switch)
+        self.switch_position = channel_obj.fiber_switch
+        self.switch_time = self.controller.clock.time()
+        return True
+
+    def post(self, function, *args, key=None):
+        """ Run function(*args), which changes the channels, in the PID thread between the
+            cycles. If no cycle is running at the moment, it runs right away in the calling
+            thread while holding the mutex of the loop. Otherwise the loop runs it before
+            the next cycle, or before it goes idle.
+            If key is given and a command of the same key is still pending, the pending one
+            is replaced by function(*args) instead, as in WorkQueue.
+        """
+        self._command_mutex.lock()
+        if key is not None and key in self._pending_commands:
+            ### slot : [key, function, args]
+            slot = self._pending_commands[key]
+            slot[1] = function
+            slot[2] = args
+            self.merged_count += 1
+        else:
+            slot = [key, function, args]
+            if key is not None:
+                self._pending_commands[key] = slot
+            self._commands.append(slot)
+        self.wait_condition.wakeAll()
+        self._command_mutex.unlock()
+
+        if self.mutex.tryLock():
+            try:
+                self._apply_commands()
+            finally:
+                self.mutex.unlock()
+
+    def _take_command(self):
+        """ Pop the oldest pending command. Return None if there is none. """
+        self._command_mutex.lock()
+        try:
+            if not self._commands:
+                return None
+            key, function, args = self._commands.popleft()
+            if key is not None:
+                del self._pending_commands[key]
+            return function, args
+        finally:
+            self._command_mutex.unlock()
+
+    def _apply_commands(self):
+        command = self._take_command()
+        if command is None:
+            return
+
+        while command is not None:
+            function, args = command
+            function(*args)
+            command = self._take_command()
+        self._publish_snapshot()
+
+    def _publish_snapshot(self):
+        """ Replace the snapshot of the controller. Readers holding the previous one are
+            not affected.
+        """
+        self.cycle_count += 1
+        self.controller.snapshot = take_snapshot(self.cycle_count, self.controller.clock.time(), \
+            self.controller._server_status, self.controller._channel_list_prio_low)
 
     def activate_loop(self):
         """ Starting the loop. Starting measurement should be done externally. """
+        self._command_mutex.lock()
         self.is_running = True
         self.wait_condition.wakeAll()
+        self._command_mutex.unlock()
+
+    def stop(self):
+        """ End the thread once the running cycle is over. """
+        self._command_mutex.lock()
+        self._quit = True
+        self.wait_condition.wakeAll()
+        self._command_mutex.unlock()
+        self.wait()
 
     def inactivate_loop(self):
         """ Stopping the loop. Stopping measurement should be done externally. """
         self.is_running = False
+        self.switch_position = None
+
+    def _record_measurement(self, channel_obj):
+        """ Keep the measurement in the history of the channel, the batch of the cycle and
+            the records of the measurement log.
+        """
+        channel_obj.history.append(channel_obj.current_time, channel_obj.current_frequency, \
+            channel_obj.current_output_voltage, channel_obj.exposure_time, channel_obj.accumulator, \
+            channel_obj.proportional, channel_obj.differentiator)
+        self._cycle_samples.append(channel_obj.measurement_sample())
+        self._cycle_records.append((channel_obj.current_time, channel_obj.name, channel_obj.current_frequency, \
+            channel_obj.current_output_voltage, channel_obj.exposure_time, channel_obj.accumulator, \
+            channel_obj.proportional, channel_obj.differentiator, channel_obj.pid_on))
+
+    def _scan_cycle(self):
+        """ Measure the channels of one scan cycle and send the batched measurements.
+            Return True if the cycle should be padded to 1 s.
+        """
+        self._apply_commands()
+        ### Asks the wavemeter once every status ttl, notifying the change to the clients
+        self.controller.wavemeter.get_status()
+        self.time_consumed = 0
+        self._cycle_samples = []
+        self._cycle_records = []
+        event_mode = self.controller.wavemeter.event_mode
+        switcher_mode = self.controller.switcher_mode
+        if self.controller._channel_list_prio_high:
+            ### Case where some channel is focused.
+            ### There should be only one channel in self.controller._channel_list_prio_high
+            focused_flag = True
+            for channel_name, channel_obj in self.controller._channel_list_prio_high.items():
+                if not channel_obj.monitor_list:
+                    ### If the focused channel has no monitoring client, focus off it
+                    self.controller._focus_off(channel_name)
+                    continue
+
+                self._measure_frequency(channel_name, channel_obj)
+                self._record_measurement(channel_obj)
+                break
+        else:
+            ### Case where no channel is focused. The scheduler decides the channels to
+            ### measure in this cycle among the monitored ones, ordered to minimize the
+            ### movement of the fiber switch.
+            focused_flag = False
+            schedule = self.scheduler.schedule(self.controller._channel_list_prio_low, self.controller.clock.time(), \
+                self.switch_position)
+            if switcher_mode and schedule:
+                self._measure_switcher(schedule)
+            else:
+                self._measure_channels(schedule)
+
+            if not schedule:
+                self.inactivate_loop()
+
+        if self._cycle_samples:
+            self.controller._inform_cycle_measurement(self._cycle_samples)
+        if self._cycle_records and self.controller.measurement_log is not None:
+            ### Written to the disk by the thread of the measurement log
+            self.controller.measurement_log.write_records(self._cycle_records)
+        self._publish_snapshot()
+
+        ### In the event mode and the switcher mode, the cycle is paced by the wavemeter itself
+        return not focused_flag and not event_mode and not switcher_mode and self.scheduler.pad_cycle
 
     def run(self):
-        last_time = time.time()
-        while True:
-            self.time_consumed = 0
+        while not self._quit:
             self.mutex.lock()
-            if self.is_running and self.controller._channel_list_prio_high:
-                ### Case where some channel is focused.
-                ### There should be only one channel in self.controller._channel_list_prio_high
-                focused_flag = True
-                for channel_name, channel_obj in self.controller._channel_list_prio_high.items():
-                    self.time_consumed += self.controller.switch_safe
-                    time.sleep(0.001 * self.controller.switch_safe)
-
-                    if not channel_obj.monitor_list:
-                        ### If the focused channel has no monitoring client, focus off it
-                        self.controller._focus_off(channel_name)
-                        continue
-
-                    self._measure_frequency(channel_name, channel_obj)
-                    break
-            elif self.is_running and not self.controller._channel_list_prio_high:
-                ### Case where no channel is focused.
-                focused_flag = False
-                monitor_exist = False
-                for channel_name, channel_obj in self.controller._channel_list_prio_low.items():
-                    self.time_consumed += self.controller.switch_safe
-                    time.sleep(0.001 * self.controller.switch_safe)
-
-                    if not channel_obj.monitor_list:
-                        continue
-                    
-                    monitor_exist = True
-                    self._measure_frequency(channel_name, channel_obj)
-
-                if not monitor_exist:
-                    self.inactivate_loop()
-            else:
-                self.wait_condition.wait(self.mutex)
+            if not self.is_running:
+                ### The commands posted while the last cycle held the mutex are run here
+                self._apply_commands()
+                self._command_mutex.lock()
+                idle = not self._commands and not self.is_running and not self._quit
                 self.mutex.unlock()
+                if idle:
+                    self.wait_condition.wait(self._command_mutex)
+                self._command_mutex.unlock()
                 continue
-            if self.time_consumed < 1000 and not focused_flag:
-                time.sleep(1 - 0.001 * self.time_consumed)
+
+            pad_cycle = self._scan_cycle()
             self.mutex.unlock()
+            ### The commands posted during the padding run right away in the posting thread
+            self._pad_cycle(pad_cycle)
+
+    def run_cycle(self):
+        """ Scan a cycle and pad it to 1 s if the scheduler asks for. With the virtual clock,
+            the padding only advances the time.
+        """
+        self._pad_cycle(self._scan_cycle())
+
+    def _pad_cycle(self, pad_cycle):
+        if pad_cycle and self.time_consumed < 1000:
+            self.controller.clock.sleep(1 - 0.001 * self.time_consumed)
+
+def _pid_state_property(name):
+    """ Attribute of Channel kept in its PIDState """
+    return property(lambda self: getattr(self.pid_state, name), \
+        lambda self, value: setattr(self.pid_state, name, value))
 
 class Channel():
-    """ Logical class representing the laser. """
-    def __init__(self, laser_name, exposure_time, pid, fiber_switch, DAC_channel, target_frequency):
+    """ Logical class representing the laser. The PID parameters and state are kept in
+        pid_state, which PIDCore steps.
+    """
+    pp = _pid_state_property('pp')
+    ii = _pid_state_property('ii')
+    dd = _pid_state_property('dd')
+    gain = _pid_state_property('gain')
+    target_frequency = _pid_state_property('target_frequency')
+    weighted_frequency = _pid_state_property('weighted_frequency')
+    accumulator = _pid_state_property('accumulator')
+    proportional = _pid_state_property('proportional')
+    differentiator = _pid_state_property('differentiator')
+
+    def __init__(self, laser_name, exposure_time, pid, fiber_switch, DAC_channel, target_frequency, \
+        history_size=DEFAULT_HISTORY_SIZE, clock=SYSTEM_CLOCK):
         ### pid : list of [0]P, [1]I, [2]D, [3]gain
         self.name = laser_name
         self.monitor_list = []
         self.fiber_switch = fiber_switch
         self.DAC_channel = DAC_channel
 
-        self.target_frequency = target_frequency
+        self.pid_state = PIDState(pid[0], pid[1], pid[2], pid[3], target_frequency)
         self.current_frequency = float(0.0)
-        self.weighted_frequency = float(0.0)
         self.current_output_voltage = float(0.0)
         self.recent_output_voltage = float(0.0)
         
         self.exposure_time = exposure_time
-        self.pp = pid[0]
-        self.ii = pid[1]
-        self.dd = pid[2]
-        self.gain = pid[3]
-        self.differentiator = float(0.0)
-        self.proportional = float(0.0)
-        self.accumulator = float(0.0)
-        self.current_time = time.time()
+        self.current_time = clock.time()
 
         self.auto_exposure_on = False
         self.pid_on = False
 
+        self.history = ChannelHistory(history_size)
+
+        ### Minimum and achieved number of measurements per second
+        self.min_update_rate = float(0.0)
+        self.update_rate = float(0.0)
+
+        ### Subscribers of the interferometer patterns : {client_name: [decimation, interval, last sent time]}
+        self.interferometer_list = {}
+
+    def record_update(self, previous_time):
+        """ Update the moving average of the achieved update rate with the interval from the
+            previous measurement.
+        """
+        interval = self.current_time - previous_time
+        if interval <= 0:
+            return
+
+        if self.update_rate == 0:
+            self.update_rate = 1.0 / interval
+        else:
+            self.update_rate = 0.8 * self.update_rate + 0.2 / interval
+
+    def measurement_sample(self):
+        """ Return the latest measurement as a row of the batched CFB message. """
+        return [self.name, self.current_frequency, self.current_output_voltage, self.accumulator, \
+            self.proportional, self.differentiator, self.current_time]
+
+    def add_interferometer_client(self, client_name, decimation, interval):
+        """ Add or update the subscription of the client to the interferometer patterns """
+        self.interferometer_list[client_name] = [decimation, interval, 0.0]
+
+    def remove_interferometer_client(self, client_name):
+        self.interferometer_list.pop(client_name, None)
+
     def add_monitor_client(self, client_name):
         """ Add new subscriber client to the monitor list """
         if client_name in self.monitor_list:
@@ -757,6 +1459,7 @@ class Channel():
             return
 
         self.monitor_list.remove(client_name)
+        self.interferometer_list.pop(client_name, None)
 
         ### For the unused channel, turn off pid and auto exposure
         if not self.monitor_list:
@@ -769,6 +1472,7 @@ class Client():
         self.name = client_name
         self.communcation_handler = communication_handler
         self.channel_list = []
+        self.batched_frame = False
 
     def send_message(self, message):
         self.communcation_handler.toMessageList(message)
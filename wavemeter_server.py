@@ -0,0 +1,59 @@
+""" Headless entry point of the wavemeter server.
+
+    Boots WavemeterController, its PID loop and AsyncServer with QtCore as the
+    only module of Qt, so the server runs without a display. The GUI server
+    (dummy_server_socket) stays available for the machines with one.
+
+    Usage : python wavemeter_server.py --config config/host.ini --backend simulator --port 9010
+"""
+
+import os
+import sys
+import socket
+import asyncio
+import argparse
+
+from wavemeter import WAVEMETER_BACKENDS
+from wavemeter_controller import WavemeterController
+from async_server import AsyncServer, DEFAULT_HOST, DEFAULT_PORT
+
+_home_dir = os.path.dirname(os.path.realpath(__file__))
+
+def _default_config():
+    return os.path.join(_home_dir, 'config', socket.gethostname() + ".ini")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless wavemeter server")
+    parser.add_argument('--config', default=None, help="configuration file, config/<host name>.ini by default")
+    parser.add_argument('--backend', choices=sorted(WAVEMETER_BACKENDS), default=None, \
+        help="wavemeter backend overriding the configuration")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="0 picks a free port")
+    args = parser.parse_args(argv)
+
+    config_file = args.config or _default_config()
+    if not os.path.isfile(config_file):
+        print("[Wavemeter server] No configuration file", config_file)
+        return 1
+
+    controller = WavemeterController(config_file, args.backend)
+    server = AsyncServer(controller, args.host, args.port)
+
+    async def serve():
+        await server.open_session()
+        print("[Wavemeter server] Listening on %s:%d - backend %s" % (server.host, server.port, \
+            controller.backend_name), flush=True)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+    ### The pending records of the measurement log are written before the threads end
+    controller.shutdown()
+    print("[Wavemeter server] Stopped")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
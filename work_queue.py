@@ -0,0 +1,108 @@
+""" Thread-safe work queue of WavemeterController.
+
+    Messages are kept in one deque per priority lane, so that enqueue and
+    dequeue are O(1) and control commands overtake the bulk parameter updates
+    waiting in the lower lane. The works of a lane are handled in the order of
+    arrival. The total number of pending messages is bounded
+    by the capacity, and put() refuses new messages when the queue is full so
+    that the caller can reply NAK to the client.
+
+    A work put with a coalescing key replaces the pending work of the same key
+    in place instead of being queued again, so that only the latest value of a
+    burst of parameter updates is applied.
+
+    Once the queue is closed, it refuses new works, and get() returns None
+    instead of blocking when no work is left, so that the consumer can end.
+"""
+
+from collections import deque
+
+from PyQt5.QtCore import QMutex, QWaitCondition
+
+from constant import *
+
+class WorkQueue():
+    def __init__(self, capacity=WORK_QUEUE_CAPACITY):
+        self.capacity = capacity
+        self._lanes = [deque() for _ in WORK_PRIORITY]
+        self._pending = {}
+        self._size = 0
+        self._closed = False
+
+        ### Number of works merged into the pending work of the same key
+        self.merged_count = 0
+        self.merged_by_key = {}
+
+        self._mutex = QMutex()
+        self._cond = QWaitCondition()
+
+    def __len__(self):
+        return self._size
+
+    def put(self, work, priority=WORK_PRIORITY["control"], key=None):
+        """ Append the work to the lane of the given priority and wake up the consumer.
+            If key is given and a work of the same key is still pending, the pending one
+            is replaced by the work instead.
+            Return False without queueing the work if the queue is full.
+        """
+        self._mutex.lock()
+        try:
+            if key is not None and key in self._pending:
+                ### slot : [key, work]
+                self._pending[key][1] = work
+                self.merged_count += 1
+                self.merged_by_key[key] = self.merged_by_key.get(key, 0) + 1
+                return True
+
+            if self._size >= self.capacity or self._closed:
+                return False
+
+            slot = [key, work]
+            if key is not None:
+                self._pending[key] = slot
+            self._lanes[priority].append(slot)
+            self._size += 1
+            self._cond.wakeOne()
+            return True
+        finally:
+            self._mutex.unlock()
+
+    def get(self, timeout=None):
+        """ Pop the oldest work of the highest priority lane. If the queue is empty,
+            block until a work arrives, or timeout ms passes when it is given.
+            Return None on timeout, or if the queue is closed and empty.
+        """
+        self._mutex.lock()
+        try:
+            while not self._size:
+                if self._closed:
+                    return None
+                elif timeout is None:
+                    self._cond.wait(self._mutex)
+                elif not self._cond.wait(self._mutex, timeout):
+                    return None
+
+            for lane in self._lanes:
+                if lane:
+                    key, work = lane.popleft()
+                    if key is not None:
+                        del self._pending[key]
+                    self._size -= 1
+                    return work
+        finally:
+            self._mutex.unlock()
+
+    def close(self):
+        """ Refuse new works and wake up the consumer waiting for one. """
+        self._mutex.lock()
+        self._closed = True
+        self._cond.wakeAll()
+        self._mutex.unlock()
+
+    def merge_statistics(self):
+        """ Return the total number of merged works and a copy of the number per key. """
+        self._mutex.lock()
+        try:
+            return self.merged_count, dict(self.merged_by_key)
+        finally:
+            self._mutex.unlock()